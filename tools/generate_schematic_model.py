@@ -1,147 +1,250 @@
 #!/usr/bin/env python3
 """
-Generate a compact, schematic glTF 2.0 model (model.gltf + model.bin), a 512x512 preview PNG,
-metadata.json and a zip package containing all artifacts.
+Generate a compact, schematic glTF 2.0 model as a single binary container (model.glb),
+a 512x512 preview PNG and metadata.json.
 
 Usage:
   python tools/generate_schematic_model.py --id model_id --name "Model Name"
 
 Dependencies:
   - Python 3.8+
-  - Pillow (optional, to generate the preview PNG). If Pillow is missing, a minimal placeholder PNG will be created.
+  - numpy (vertex/index buffer packing)
+  - numba (optional, JIT-compiles the bounding-box kernel for batch generation)
+  - orjson (optional, faster compact JSON encoding; falls back to the json module)
+  - Pillow (optional, to generate the preview PNG). If Pillow is missing, a solid-color 512x512 PNG is written instead.
 
 Safety: This script generates schematic, non-functional geometry only and embeds metadata marking
 "safety_level": "educational".
 """
 
 import argparse
+import functools
+import hashlib
 import json
 import math
 import os
 import struct
-import zipfile
+import zlib
 from pathlib import Path
 
+import numpy as np
+
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 try:
     from PIL import Image, ImageDraw, ImageFont
     PIL_AVAILABLE = True
 except Exception:
     PIL_AVAILABLE = False
 
-# Simple helper to create a unit cube centered at origin
+# Unit cube centered at origin (8 vertices); emitted once and instanced per part
+CUBE_TEMPLATE = np.array([
+    (-0.5, -0.5,  0.5),
+    ( 0.5, -0.5,  0.5),
+    ( 0.5,  0.5,  0.5),
+    (-0.5,  0.5,  0.5),
+    (-0.5, -0.5, -0.5),
+    ( 0.5, -0.5, -0.5),
+    ( 0.5,  0.5, -0.5),
+    (-0.5,  0.5, -0.5),
+], dtype='<f4')
+
+# Triangles (two per face) using uint16 indices; identical for every box
+CUBE_INDICES = np.array([
+    0,1,2, 0,2,3,  # front
+    4,6,5, 4,7,6,  # back
+    4,5,1, 4,1,0,  # bottom
+    3,2,6, 3,6,7,  # top
+    1,5,6, 1,6,2,  # right
+    4,0,3, 4,3,7,  # left
+], dtype='<u2')
+
+# Bounding-box kernel: JIT-compiled with numba when available, plain numpy otherwise
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _unit_scale(coords):
+        # factor that makes the longest bounding-box side of (N,3) coords 1.0
+        n = coords.shape[0]
+        if n == 0:
+            return 1.0
+        lo = coords[0].copy()
+        hi = coords[0].copy()
+        for i in range(1, n):
+            for j in range(3):
+                v = coords[i, j]
+                if v < lo[j]:
+                    lo[j] = v
+                if v > hi[j]:
+                    hi[j] = v
+        longest = max(hi[0] - lo[0], hi[1] - lo[1], hi[2] - lo[2])
+        if longest == 0:
+            return 1.0
+        return 1.0 / longest
+else:
+    def _unit_scale(coords):
+        # factor that makes the longest bounding-box side of (N,3) coords 1.0
+        if not coords.size:
+            return 1.0
+        longest = float((coords.max(axis=0) - coords.min(axis=0)).max())
+        return 1.0 / longest if longest != 0 else 1.0
+
+# Simple helper to create a box: the shared unit cube plus its 4x4 placement
 def create_box(center, size):
-    cx, cy, cz = center
-    sx, sy, sz = size
-    # 8 vertices
-    x = sx / 2.0
-    y = sy / 2.0
-    z = sz / 2.0
-    verts = [
-        (cx - x, cy - y, cz + z),
-        (cx + x, cy - y, cz + z),
-        (cx + x, cy + y, cz + z),
-        (cx - x, cy + y, cz + z),
-        (cx - x, cy - y, cz - z),
-        (cx + x, cy - y, cz - z),
-        (cx + x, cy + y, cz - z),
-        (cx - x, cy + y, cz - z),
-    ]
-    # Triangles (two per face) using uint16 indices
-    indices = [
-        0,1,2, 0,2,3,  # front
-        4,6,5, 4,7,6,  # back
-        4,5,1, 4,1,0,  # bottom
-        3,2,6, 3,6,7,  # top
-        1,5,6, 1,6,2,  # right
-        4,0,3, 4,3,7,  # left
-    ]
-    return verts, indices
+    transform = np.diag([float(size[0]), float(size[1]), float(size[2]), 1.0])
+    transform[:3, 3] = [float(center[0]), float(center[1]), float(center[2])]
+    return CUBE_TEMPLATE, CUBE_INDICES, transform
+
+
+def _world_positions(m):
+    # (N,3) positions of a part after applying its placement transform
+    pos_arr = np.asarray(m['positions'], dtype='<f8').reshape(-1, 3)
+    transform = m.get('matrix', np.eye(4))
+    return pos_arr @ transform[:3, :3].T + transform[:3, 3]
+
+def quantize_positions(pos_arr):
+    # Encode (N,3) float positions as normalized int16 over the geometry's own bounding
+    # box (KHR_mesh_quantization). Returns (N,4) int16 rows (x, y, z, pad) plus the
+    # translation/scale that maps the [-1, 1] decoded range back to the box.
+    mn = pos_arr.min(axis=0).astype('<f8')
+    mx = pos_arr.max(axis=0).astype('<f8')
+    center = (mn + mx) / 2
+    half = (mx - mn) / 2
+    half[half == 0] = 1.0  # flat axis: every vertex sits at the center
+    q = np.zeros((pos_arr.shape[0], 4), dtype='<i2')
+    q[:, :3] = np.round((pos_arr - center) / half * 32767)
+    return q, center.tolist(), half.tolist()
 
 # Flatten arrays and build binary buffer
 def build_buffer_for_meshes(meshes):
-    # meshes: list of dicts with 'positions' list[(x,y,z)] and 'indices' list[int]
-    buffer_bytes = bytearray()
+    # meshes: list of dicts with 'positions' (N,3) array-like, 'indices' array-like
+    # and an optional 4x4 'matrix' placement. Layout: each distinct position set
+    # (quantized) exactly once, then each distinct index list exactly once; parts
+    # instancing the same geometry share its accessors.
+    pos_keys = [np.asarray(m['positions'], dtype='<f4').reshape(-1, 3).tobytes() for m in meshes]
+    pos_blocks = dict.fromkeys(pos_keys)  # distinct position sets -> (accessor, dequantize matrix)
+    idx_keys = [np.asarray(m['indices'], dtype='<u2').tobytes() for m in meshes]
+    idx_blocks = dict.fromkeys(idx_keys)  # distinct index lists -> accessor index
+
+    quantized = {}
+    for pos_bytes in pos_blocks:
+        quantized[pos_bytes] = quantize_positions(np.frombuffer(pos_bytes, dtype='<f4').reshape(-1, 3))
+
+    # Size the buffer up-front and copy each block into place once
+    total = sum(q.nbytes for q, _, _ in quantized.values()) + sum(len(b) for b in idx_blocks)
+    buf = bytearray(total)
+    mv = memoryview(buf)
+    off = 0
     buffer_views = []
     accessors = []
 
-    # We'll create for each mesh: positions (float32), indices (uint16)
-    for m in meshes:
-        # positions
-        pos_offset = len(buffer_bytes)
-        for (x,y,z) in m['positions']:
-            buffer_bytes += struct.pack('<fff', float(x), float(y), float(z))
-        pos_length = len(m['positions']) * 12  # 3 * 4 bytes
-
-        # create bufferView for positions
+    # positions (normalized int16, 6 bytes + 2 pad per vertex to keep attributes
+    # 4-byte aligned), one bufferView/accessor per distinct position set
+    for pos_bytes, (q, translation, scale) in quantized.items():
+        n = q.nbytes  # 4 * 2 bytes per vertex
+        mv[off:off+n] = q.tobytes()
         buffer_views.append({
             'buffer': 0,
-            'byteOffset': pos_offset,
-            'byteLength': pos_length,
+            'byteOffset': off,
+            'byteLength': n,
+            'byteStride': 8,
             'target': 34962 # ARRAY_BUFFER
         })
-        accessor_pos_index = len(accessors)
+        off += n
+        dequantize = np.diag(scale + [1.0])
+        dequantize[:3, 3] = translation
+        pos_blocks[pos_bytes] = (len(accessors), dequantize)
         accessors.append({
             'bufferView': len(buffer_views)-1,
             'byteOffset': 0,
-            'componentType': 5126, # FLOAT
-            'count': len(m['positions']),
+            'componentType': 5122, # SHORT
+            'normalized': True,
+            'count': q.shape[0],
             'type': 'VEC3',
-            'min': [min(p[i] for p in m['positions']) for i in range(3)],
-            'max': [max(p[i] for p in m['positions']) for i in range(3)],
+            'min': q[:, :3].min(axis=0).tolist(),
+            'max': q[:, :3].max(axis=0).tolist(),
         })
-
-        # indices (uint16)
-        idx_offset = len(buffer_bytes)
-        for idx in m['indices']:
-            buffer_bytes += struct.pack('<H', int(idx))
-        idx_length = len(m['indices']) * 2
-
+    for m, pos_bytes in zip(meshes, pos_keys):
+        m['accessor_pos'], dequantize = pos_blocks[pos_bytes]
+        # node transform: dequantize into the geometry's box, then place the part
+        m['node_matrix'] = m.get('matrix', np.eye(4)) @ dequantize
+
+    # indices (uint16), emitted once per distinct index list
+    for idx_bytes in idx_blocks:
+        n = len(idx_bytes)
+        mv[off:off+n] = idx_bytes
         buffer_views.append({
             'buffer': 0,
-            'byteOffset': idx_offset,
-            'byteLength': idx_length,
+            'byteOffset': off,
+            'byteLength': n,
             'target': 34963 # ELEMENT_ARRAY_BUFFER
         })
-        accessor_idx_index = len(accessors)
+        off += n
+        idx_blocks[idx_bytes] = len(accessors)
         accessors.append({
             'bufferView': len(buffer_views)-1,
             'byteOffset': 0,
             'componentType': 5123, # UNSIGNED_SHORT
-            'count': len(m['indices']),
+            'count': n // 2,
             'type': 'SCALAR'
         })
-
-        # record indexes for mesh construction
-        m['accessor_pos'] = accessor_pos_index
-        m['accessor_idx'] = accessor_idx_index
+    for m, idx_bytes in zip(meshes, idx_keys):
+        m['accessor_idx'] = idx_blocks[idx_bytes]
 
     # Return buffer bytes and glTF bufferViews/accessors
-    return bytes(buffer_bytes), buffer_views, accessors
+    return bytes(buf), buffer_views, accessors
 
 
 def normalize_scale(meshes):
-    # scale meshes so longest dimension = 1.0
-    all_coords = []
-    for m in meshes:
-        for p in m['positions']:
-            all_coords.append(p)
-    xs = [c[0] for c in all_coords]
-    ys = [c[1] for c in all_coords]
-    zs = [c[2] for c in all_coords]
-    if not xs:
-        return meshes
-    span_x = max(xs)-min(xs)
-    span_y = max(ys)-min(ys)
-    span_z = max(zs)-min(zs)
-    longest = max(span_x, span_y, span_z)
-    if longest == 0:
+    # scale part placements so the longest dimension of the assembled model = 1.0
+    if not meshes:
         return meshes
-    scale = 1.0 / longest
+    factor = _unit_scale(np.concatenate([_world_positions(m) for m in meshes]))
     for m in meshes:
-        m['positions'] = [(x*scale, y*scale, z*scale) for (x,y,z) in m['positions']]
+        transform = np.array(m.get('matrix', np.eye(4)), dtype='<f8')
+        transform[:3, :] *= factor
+        m['matrix'] = transform
     return meshes
 
 
+def _png_chunk(chunk_type, data):
+    # PNG chunk: length, type, data, CRC32 over type + data (all big-endian)
+    return (struct.pack('>I', len(data)) + chunk_type + data
+            + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+
+def _emit_solid_png(path, w=512, h=512, rgb=(10,14,39)):
+    # 8-bit RGB, no interlace; every scanline is filter type 0 followed by w pixels
+    ihdr = struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)
+    idat = zlib.compress((b'\x00' + bytes(rgb) * w) * h)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_png_chunk(b'IHDR', ihdr))
+        f.write(_png_chunk(b'IDAT', idat))
+        f.write(_png_chunk(b'IEND', b''))
+
+
+@functools.lru_cache(maxsize=8)
+def _font(size=18):
+    # Parsing the TTF is the fixed cost of each preview; load each size once
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', size)
+    except Exception:
+        return ImageFont.load_default()
+
+
 def generate_preview_png(out_path, model_name):
     # Simple schematic thumbnail: rectangles for body and accessories
     size = (512,512)
@@ -155,10 +258,7 @@ def generate_preview_png(out_path, model_name):
         # accessory_2
         draw.rectangle([80,220,150,290], fill=(51,51,51,255))
         # text label
-        try:
-            font = ImageFont.truetype('DejaVuSans.ttf', 18)
-        except Exception:
-            font = ImageFont.load_default()
+        font = _font(18)
         text = (model_name or 'schematic').upper()
         # Determine text size robustly across Pillow versions
         try:
@@ -170,13 +270,12 @@ def generate_preview_png(out_path, model_name):
             except Exception:
                 w, h = 200, 20
         draw.text(((512-w)/2, 12), text, fill=(255,255,255,220), font=font)
-        img.save(out_path)
+        # The thumbnail is opaque and uses only a few dozen flat colors: a palette
+        # PNG is smaller and faster to deflate than 32-bit RGBA
+        img.convert('RGB').quantize(colors=256).save(out_path)
     else:
-        # If Pillow not available, write a small single-color PNG data (512x512) using a minimal precomputed base64.
-        # We'll emit a tiny 1x1 PNG scaled metadata is not possible; instead create a minimal binary placeholder (not a valid image)
-        with open(out_path, 'wb') as f:
-            f.write(b'\x89PNG\r\n\x1a\n')
-            f.write(b'Placeholder preview - install Pillow to generate real PNG')
+        # Without Pillow, emit a valid solid background PNG (no schematic shapes)
+        _emit_solid_png(out_path, size[0], size[1], (10,14,39))
 
 
 def write_gltf(out_dir, meshes, buffer_bytes):
@@ -202,37 +301,37 @@ def build_gltf_json(meshes, buffer_views, accessors, model_id, model_name):
         'scene': 0,
         'nodes': [],
         'meshes': [],
-        'buffers': [{'uri': 'model.bin', 'byteLength': 0}],
+        'buffers': [{'byteLength': 0}],  # GLB-stored buffer (no uri)
         'bufferViews': buffer_views,
         'accessors': accessors,
+        # Positions are normalized int16; each node's matrix decodes them
+        'extensionsUsed': ['KHR_mesh_quantization'],
+        'extensionsRequired': ['KHR_mesh_quantization'],
     }
-    # Create one mesh per logical part, each mesh will contain two primitives (high & low LOD)
+    # Create one mesh per logical part with a single primitive. Parts built from
+    # the same geometry reference the same accessors. No separate low-LOD primitive
+    # is emitted: it would reference the same accessors too.
     for m in meshes:
-        # Each primitive uses the stored accessor indices
-        prim_high = {
+        prim = {
             'attributes': {
                 'POSITION': m['accessor_pos']
             },
             'indices': m['accessor_idx'],
             'mode': 4 # TRIANGLES
         }
-        # Low LOD: for this simple generator we'll point to same geometry (clients can choose to use primitive 1)
-        prim_low = {
-            'attributes': {
-                'POSITION': m['accessor_pos']
-            },
-            'indices': m['accessor_idx'],
-            'mode': 4
-        }
         gltf['meshes'].append({
             'name': m['name'] + '_mesh',
-            'primitives': [prim_high, prim_low],
-            'extras': {'lod_primitives': {'high': 0, 'low': 1}}
+            'primitives': [prim],
         })
 
-    # Nodes for scene, referencing each mesh
+    # Nodes for scene, referencing each mesh; the column-major matrix dequantizes
+    # the shared geometry and places this part
     for i, m in enumerate(meshes):
-        gltf['nodes'].append({'name': m['name'], 'mesh': i})
+        gltf['nodes'].append({
+            'name': m['name'],
+            'mesh': i,
+            'matrix': m['node_matrix'].T.ravel().tolist(),
+        })
 
     # Fill buffer byteLength
     total_buf_len = sum(bv['byteLength'] for bv in buffer_views)
@@ -244,11 +343,35 @@ def build_gltf_json(meshes, buffer_views, accessors, model_id, model_name):
     return gltf
 
 
+def write_glb(path, gltf_json, bin_bytes):
+    # glTF 2.0 binary container: 12-byte header, JSON chunk, BIN chunk.
+    # Chunks are 4-byte aligned: JSON padded with spaces, BIN with zeros.
+    json_bytes = _dumps(gltf_json)
+    json_bytes += b' ' * (-len(json_bytes) % 4)
+    bin_bytes = bytes(bin_bytes) + b'\x00' * (-len(bin_bytes) % 4)
+    total_len = 12 + 8 + len(json_bytes) + 8 + len(bin_bytes)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<III', 0x46546C67, 2, total_len))  # magic 'glTF', version 2
+        f.write(struct.pack('<II', len(json_bytes), 0x4E4F534A))  # 'JSON'
+        f.write(json_bytes)
+        f.write(struct.pack('<II', len(bin_bytes), 0x004E4942))  # 'BIN\0'
+        f.write(bin_bytes)
+
+
+def compute_cache_key(model_id, model_name):
+    # Keyed on the inputs plus the generator itself, so editing this script
+    # (or installing/removing Pillow) invalidates previously generated packages
+    generator_hash = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()
+    key = f"{model_id}:{model_name}:{generator_hash}:{PIL_AVAILABLE}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--id', required=True, help='Model ID (used in filenames)')
     parser.add_argument('--name', required=False, default='', help='Model display name')
     parser.add_argument('--out', required=False, default='.', help='Output directory')
+    parser.add_argument('--force', action='store_true', help='Regenerate even if cached artifacts are up to date')
     args = parser.parse_args()
 
     out_dir = Path(args.out)
@@ -257,15 +380,27 @@ def main():
     model_id = args.id
     model_name = args.name or args.id
 
+    # Skip regeneration when this exact model was already generated
+    glb_path = out_dir / 'model.glb'
+    preview_path = out_dir / 'preview.png'
+    metadata_path = out_dir / 'metadata.json'
+    cache_key_path = out_dir / '.cache_key'
+    cache_key = compute_cache_key(model_id, model_name)
+    artifacts = (glb_path, preview_path, metadata_path)
+    if (not args.force and cache_key_path.exists() and all(p.exists() for p in artifacts)
+            and cache_key_path.read_text().strip() == cache_key):
+        print('Up to date (cached):', glb_path)
+        return
+
     # Define three box parts positioned along X axis
-    body_verts, body_indices = create_box((0.0, 0.0, 0.0), (1.0, 0.6, 0.4))
-    acc1_verts, acc1_indices = create_box((0.8, -0.1, 0.0), (0.3, 0.25, 0.1))
-    acc2_verts, acc2_indices = create_box((-0.8, -0.1, 0.0), (0.25, 0.2, 0.1))
+    body_verts, body_indices, body_matrix = create_box((0.0, 0.0, 0.0), (1.0, 0.6, 0.4))
+    acc1_verts, acc1_indices, acc1_matrix = create_box((0.8, -0.1, 0.0), (0.3, 0.25, 0.1))
+    acc2_verts, acc2_indices, acc2_matrix = create_box((-0.8, -0.1, 0.0), (0.25, 0.2, 0.1))
 
     meshes = [
-        {'name': 'body', 'positions': body_verts, 'indices': body_indices},
-        {'name': 'accessory_1', 'positions': acc1_verts, 'indices': acc1_indices},
-        {'name': 'accessory_2', 'positions': acc2_verts, 'indices': acc2_indices},
+        {'name': 'body', 'positions': body_verts, 'indices': body_indices, 'matrix': body_matrix},
+        {'name': 'accessory_1', 'positions': acc1_verts, 'indices': acc1_indices, 'matrix': acc1_matrix},
+        {'name': 'accessory_2', 'positions': acc2_verts, 'indices': acc2_indices, 'matrix': acc2_matrix},
     ]
 
     # Normalize scale so longest dimension == 1.0
@@ -277,15 +412,8 @@ def main():
     # Build glTF JSON
     gltf = build_gltf_json(meshes, buffer_views, accessors, model_id, model_name)
 
-    # Write model.bin
-    bin_path = out_dir / 'model.bin'
-    with open(bin_path, 'wb') as f:
-        f.write(buffer_bytes)
-
-    # Write model.gltf
-    gltf_path = out_dir / 'model.gltf'
-    with open(gltf_path, 'w', encoding='utf-8') as f:
-        json.dump(gltf, f, indent=2)
+    # Write model.glb (JSON + binary buffer in one file)
+    write_glb(glb_path, gltf, buffer_bytes)
 
     # Write metadata.json
     metadata = {
@@ -294,22 +422,16 @@ def main():
         'source': 'antigravity',
         'safety_level': 'educational'
     }
-    with open(out_dir / 'metadata.json', 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2)
+    with open(metadata_path, 'wb') as f:
+        f.write(_dumps(metadata))
 
     # Generate preview PNG
-    preview_path = out_dir / 'preview.png'
     generate_preview_png(preview_path, model_name)
 
-    # Package into zip
-    zip_path = out_dir / f"{model_id}.zip"
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as z:
-        z.write(gltf_path, arcname='model.gltf')
-        z.write(bin_path, arcname='model.bin')
-        z.write(preview_path, arcname='preview.png')
-        z.write(out_dir / 'metadata.json', arcname='metadata.json')
+    # Record the cache key last so an interrupted run is regenerated
+    cache_key_path.write_text(cache_key)
 
-    print('Generated package:', zip_path)
+    print('Generated model:', glb_path)
     print('Notes: This asset is schematic and marked as educational. It contains no functional internals or assembly instructions.')
 
 if __name__ == '__main__':
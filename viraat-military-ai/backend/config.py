@@ -13,14 +13,23 @@ class Settings(BaseSettings):
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     api_reload: bool = True
+    web_concurrency: int = 1  # uvicorn worker processes (WEB_CONCURRENCY)
     
     # Security
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    auth_cache_maxsize: int = 10000  # verified tokens kept by get_current_user
+    auth_cache_ttl: int = 5  # seconds
+    password_cache_maxsize: int = 4096
+    password_cache_ttl: int = 300  # seconds a verified password skips the KDF
     
     # Database (SQLite by default, PostgreSQL for production)
     database_url: str = "sqlite:///./viraat_military_ai.db"
+    db_pool_size: int = 10  # PostgreSQL only
+    db_max_overflow: int = 20
+    db_pool_recycle: int = 1800  # seconds
+    db_query_cache_size: int = 1200  # compiled SQL statements kept per engine
     
     # LLM Settings
     llm_model_path: str = "./models/llm/mistral-7b-instruct-v0.2.Q4_K_M.gguf"
@@ -47,6 +56,9 @@ class Settings(BaseSettings):
     
     # Analytics
     enable_analytics: bool = True
+    analytics_batch_size: int = 500
+    analytics_flush_interval: float = 1.0  # seconds
+    analytics_rollup_interval: int = 300  # seconds between analytics_daily rebuilds
     
     class Config:
         env_file = ".env"
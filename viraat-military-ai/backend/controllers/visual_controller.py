@@ -1,48 +1,84 @@
+import functools
+import re
 from typing import Dict, Optional, Tuple
 from loguru import logger
 
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+_WORD_RE = re.compile(r'\w+')
+
+# Map keywords to 3D asset IDs and types
+# Type: 'weapon', 'vehicle', 'structure'
+# 'asset_path': optional glTF binary (GLB) model hosted under /models/{id}/model.glb
+_MODEL_REGISTRY = {
+    "ak-47": {"id": "ak47", "type": "weapon", "name": "AK-47 Assault Rifle", "asset_path": "/models/ak47/model.glb"},
+    "ak47": {"id": "ak47", "type": "weapon", "name": "AK-47 Assault Rifle", "asset_path": "/models/ak47/model.glb"},
+    "akm": {"id": "ak47", "type": "weapon", "name": "AKM Variant", "asset_path": "/models/ak47/model.glb"},
+    "m4a1": {"id": "m4a1", "type": "weapon", "name": "M4A1 Carbine", "asset_path": "/models/m4a1/model.glb"},
+    "m4": {"id": "m4a1", "type": "weapon", "name": "M4A1 Carbine", "asset_path": "/models/m4a1/model.glb"},
+    "cheytac": {"id": "dlq33", "type": "weapon", "name": "CheyTac M200 Intervention", "asset_path": "/models/dlq33/model.glb"},
+    "dlq": {"id": "dlq33", "type": "weapon", "name": "DLQ-33 Sniper", "asset_path": "/models/dlq33/model.glb"},
+    "l96a1": {"id": "l96a1", "type": "weapon", "name": "L96A1 Sniper", "asset_path": "/models/l96a1/model.glb"},
+    "tank": {"id": "t90", "type": "vehicle", "name": "T-90 Main Battle Tank", "asset_path": "/models/t90/model.glb"},
+    "bunker": {"id": "bunker", "type": "structure", "name": "Reinforced Bunker", "asset_path": "/models/bunker/model.glb"},
+}
+
+# Keywords that strongly suggest a desire to SEE something
+_TRIGGERS = (
+    "show me", "visual of", "3d model", "what does", "look like", 
+    "display", "render", "view", "visualize"
+)
+
 class VisualController:
     """Controller for determining 3D visualization intent and asset mapping."""
     
     def __init__(self):
-        # Map keywords to 3D asset IDs and types
-        # Type: 'weapon', 'vehicle', 'structure'
-        # 'asset_path': optional glTF model hosted under /models/{id}/model.gltf
-        self.model_registry = {
-            "ak-47": {"id": "ak47", "type": "weapon", "name": "AK-47 Assault Rifle", "asset_path": "/models/ak47/model.gltf"},
-            "ak47": {"id": "ak47", "type": "weapon", "name": "AK-47 Assault Rifle", "asset_path": "/models/ak47/model.gltf"},
-            "akm": {"id": "ak47", "type": "weapon", "name": "AKM Variant", "asset_path": "/models/ak47/model.gltf"},
-            "m4a1": {"id": "m4a1", "type": "weapon", "name": "M4A1 Carbine", "asset_path": "/models/m4a1/model.gltf"},
-            "m4": {"id": "m4a1", "type": "weapon", "name": "M4A1 Carbine", "asset_path": "/models/m4a1/model.gltf"},
-            "cheytac": {"id": "dlq33", "type": "weapon", "name": "CheyTac M200 Intervention", "asset_path": "/models/dlq33/model.gltf"},
-            "dlq": {"id": "dlq33", "type": "weapon", "name": "DLQ-33 Sniper", "asset_path": "/models/dlq33/model.gltf"},
-            "l96a1": {"id": "l96a1", "type": "weapon", "name": "L96A1 Sniper", "asset_path": "/models/l96a1/model.gltf"},
-            "tank": {"id": "t90", "type": "vehicle", "name": "T-90 Main Battle Tank", "asset_path": "/models/t90/model.gltf"},
-            "bunker": {"id": "bunker", "type": "structure", "name": "Reinforced Bunker", "asset_path": "/models/bunker/model.gltf"},
-        }
-        
-        # Keywords that strongly suggest a desire to SEE something
-        self.visual_triggers = [
-            "show me", "visual of", "3d model", "what does", "look like", 
-            "display", "render", "view", "visualize"
-        ]
+        self.model_registry = _MODEL_REGISTRY
+        self.visual_triggers = _TRIGGERS
+        self._keys_sorted = tuple(sorted(self.model_registry, key=len, reverse=True))
 
-    def analyze(self, query: str) -> Optional[Dict]:
-        """
-        Analyze query for visual intent.
-        Returns a directive dict if a visual should be triggered, else None.
-        """
-        query_lower = query.lower()
-        
+        # Precompiled single-pass matchers (longest key first so "ak-47" wins over shorter keys)
+        self._model_re = re.compile('|'.join(re.escape(k) for k in self._keys_sorted))
+        # One-word triggers are checked by set intersection, phrases by substring
+        self._single_triggers = frozenset(t for t in self.visual_triggers if ' ' not in t)
+        self._multi_triggers = tuple(t for t in self.visual_triggers if ' ' in t)
+
+        # Aho-Corasick automaton: one pass over the query regardless of registry size
+        self._model_automaton = None
+        if AHOCORASICK_AVAILABLE:
+            self._model_automaton = ahocorasick.Automaton()
+            for key in self._keys_sorted:
+                self._model_automaton.add_word(key, (key, self.model_registry[key]))
+            self._model_automaton.make_automaton()
+
+        # analyze() is a pure function of the lowercased query; cache resubmitted queries
+        self._analyze_cached = functools.lru_cache(maxsize=1024)(self._analyze_lower)
+
+    def _match_model(self, query_lower: str) -> Optional[Dict]:
+        """Return the registry entry for the leftmost (then longest) key in the query."""
+        if self._model_automaton is None:
+            match = self._model_re.search(query_lower)
+            return self.model_registry[match.group(0)] if match else None
+
+        best = None
+        for end, (key, model_data) in self._model_automaton.iter(query_lower):
+            rank = (end - len(key), -len(key))
+            if best is None or rank < best[0]:
+                best = (rank, model_data)
+        return best[1] if best else None
+
+    def _analyze_lower(self, query_lower: str) -> Optional[Tuple[str, str, str, Optional[str]]]:
+        """Pure part of analyze(); memoized per instance on the lowercased query."""
         # 1. Check for explicit visual intent
-        has_intent = any(trigger in query_lower for trigger in self.visual_triggers)
+        has_intent = (not self._single_triggers.isdisjoint(_WORD_RE.findall(query_lower))
+                      or any(t in query_lower for t in self._multi_triggers))
         
         # 2. Find mentioned entities
-        matched_model = None
-        for key, model_data in self.model_registry.items():
-            if key in query_lower:
-                matched_model = model_data
-                break
+        matched_model = self._match_model(query_lower)
         
         # 3. Decision Logic:
         # - If explicit intent + entity found -> SHOW
@@ -50,17 +86,30 @@ class VisualController:
         # - For this implementation, we will be aggressive: if an entity is clearly the subject, show it.
         
         if matched_model:
-            logger.info(f"Visual intent detected for: {matched_model['name']}")
-            return {
-                "type": "3d_view",
-                "model_id": matched_model['id'],
-                "model_type": matched_model['type'],
-                "model_name": matched_model['name'],
-                "asset_path": matched_model.get('asset_path'),
-                "safety_note": "This model is for educational/visualization use only; operational details withheld."
-            }
+            return (matched_model['id'], matched_model['type'], matched_model['name'],
+                    matched_model.get('asset_path'))
             
         return None
 
+    def analyze(self, query: str) -> Optional[Dict]:
+        """
+        Analyze query for visual intent.
+        Returns a directive dict if a visual should be triggered, else None.
+        """
+        match = self._analyze_cached(query.lower())
+        if not match:
+            return None
+
+        model_id, model_type, model_name, asset_path = match
+        logger.info(f"Visual intent detected for: {model_name}")
+        return {
+            "type": "3d_view",
+            "model_id": model_id,
+            "model_type": model_type,
+            "model_name": model_name,
+            "asset_path": asset_path,
+            "safety_note": "This model is for educational/visualization use only; operational details withheld."
+        }
+
 # Global instance
 visual_controller = VisualController()
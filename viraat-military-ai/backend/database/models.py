@@ -1,18 +1,69 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Float, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import create_engine, event, inspect, case, update, Column, Integer, String, Boolean, Float, Text, Date, DateTime, ForeignKey, JSON, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from sqlalchemy.sql import func, text
 from config import settings
 
+
+def _create_engine():
+    """Create the database engine with backend-specific pool settings."""
+    if settings.database_url.startswith("sqlite"):
+        # Sessions may be used from FastAPI's threadpool, not only the creating thread
+        sqlite_engine = create_engine(
+            settings.database_url,
+            echo=False,
+            connect_args={"check_same_thread": False},
+            query_cache_size=settings.db_query_cache_size,
+        )
+
+        @event.listens_for(sqlite_engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA cache_size=-64000")  # 64 MB page cache
+            cursor.execute("PRAGMA foreign_keys=ON")  # enforce ON DELETE CASCADE / SET NULL
+            cursor.close()
+
+        return sqlite_engine
+
+    return create_engine(
+        settings.database_url,
+        echo=False,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=settings.db_pool_recycle,
+        query_cache_size=settings.db_query_cache_size,
+    )
+
+
 # Create database engine
-engine = create_engine(settings.database_url, echo=False)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = _create_engine()
+# Objects stay loaded after commit; generated columns are fetched by the INSERT/UPDATE
+# itself (eager_defaults -> RETURNING), so no refresh() or reload SELECT is needed
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+# Read-only sessions fetch rows in batches (server-side cursors where supported)
+ReadSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine.execution_options(stream_results=True, yield_per=100),
+)
 Base = declarative_base()
 
+# Permission level per role; stored on each user as role_level so checks are one compare
+ROLE_LEVELS = {"admin": 3, "analyst": 2, "user": 1}
+
+# Timestamps are computed by the database (CURRENT_TIMESTAMP / now()) rather than in
+# Python. server_default covers new tables; the SQL-expression default is rendered
+# inline in each INSERT so tables created before server defaults still get a value.
+
 
 class User(Base):
     """User model for authentication."""
     __tablename__ = "users"
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False, index=True)
@@ -20,9 +71,10 @@ class User(Base):
     hashed_password = Column(String(255), nullable=False)
     full_name = Column(String(100))
     role = Column(String(20), default="user")
+    role_level = Column(Integer, default=ROLE_LEVELS["user"], server_default="1", nullable=False)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now(), server_default=func.now())
+    updated_at = Column(DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
     
     # Relationships
     conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan")
@@ -33,28 +85,40 @@ class User(Base):
 class Conversation(Base):
     """Conversation model."""
     __tablename__ = "conversations"
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
     title = Column(String(255))
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now(), server_default=func.now())
+    updated_at = Column(DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
     
     # Relationships
     user = relationship("User", back_populates="conversations")
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    # passive_deletes: deleting a conversation leaves its messages to the FK cascade
+    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan",
+                            passive_deletes=True)
+
+
+# Serves a user's conversation list newest-first (and its (updated_at, id) keyset pages) without a sort
+Index("ix_conversations_user_updated_id", Conversation.user_id,
+      Conversation.updated_at.desc(), Conversation.id.desc())
 
 
 class Message(Base):
     """Message model."""
     __tablename__ = "messages"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_messages_conv_created", "conversation_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"))
     role = Column(String(20), nullable=False)  # 'user', 'assistant', 'system'
     content = Column(Text, nullable=False)
-    message_metadata = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    message_metadata = Column(JSON().with_variant(JSONB(), "postgresql"))  # binary JSONB on PostgreSQL
+    created_at = Column(DateTime, default=func.now(), server_default=func.now())
     
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
@@ -63,6 +127,18 @@ class Message(Base):
 class Analytics(Base):
     """Analytics model for tracking queries."""
     __tablename__ = "analytics"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_analytics_user_time", "user_id", "created_at"),
+        Index("ix_analytics_model", "model_used"),
+        # Partial index over RAG-backed queries only; covering on PostgreSQL
+        Index(
+            "ix_analytics_rag", "user_id",
+            sqlite_where=text("rag_sources_used > 0"),
+            postgresql_where=text("rag_sources_used > 0"),
+            postgresql_include=["rag_sources_used"],
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
@@ -71,15 +147,37 @@ class Analytics(Base):
     model_used = Column(String(100))
     tokens_used = Column(Integer)
     rag_sources_used = Column(Integer)
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=func.now(), server_default=func.now(), index=True)
     
     # Relationships
     user = relationship("User", back_populates="analytics")
 
 
+# Popular-query grouping key on PostgreSQL (SQLite has no md5())
+Index("ix_analytics_query_md5", func.md5(Analytics.query), Analytics.user_id).ddl_if(dialect="postgresql")
+
+
+class AnalyticsDaily(Base):
+    """Per-user daily rollup of analytics, rebuilt periodically (a portable materialized view)."""
+    __tablename__ = "analytics_daily"
+    __table_args__ = (
+        Index("ix_analytics_daily_day_user", "day", "user_id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=True)  # no FK: the table is replaced wholesale on refresh
+    day = Column(Date, nullable=False)
+    query_count = Column(Integer, nullable=False)
+    # Sums rather than averages so any range of days can be re-aggregated exactly
+    response_time_total = Column(Float)
+    rag_query_count = Column(Integer, nullable=False)
+    rag_sources_total = Column(Integer)
+
+
 class Document(Base):
     """Document model for uploaded files."""
     __tablename__ = "documents"
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255), nullable=False)
@@ -90,7 +188,7 @@ class Document(Base):
     category = Column(String(100))
     status = Column(String(20), default="processing")
     embedding_id = Column(String(255))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now(), server_default=func.now())
     
     # Relationships
     uploader = relationship("User", back_populates="documents")
@@ -100,6 +198,18 @@ class Document(Base):
 def get_db():
     """Get database session."""
     db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def get_read_db():
+    """Get a read-only database session for list/aggregate endpoints."""
+    db = ReadSessionLocal()
     try:
         yield db
     finally:
@@ -110,3 +220,16 @@ def get_db():
 def init_db():
     """Initialize database tables."""
     Base.metadata.create_all(bind=engine)
+    # create_all skips existing tables; add columns and indexes introduced since they were created
+    user_columns = {column["name"] for column in inspect(engine).get_columns("users")}
+    if "role_level" not in user_columns:
+        users = User.__table__
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE users ADD COLUMN role_level INTEGER NOT NULL DEFAULT 1"))
+            conn.execute(update(users).values(role_level=case(ROLE_LEVELS, value=users.c.role, else_=0)))
+    with engine.begin() as conn:
+        # Superseded by ix_conversations_user_updated_id
+        conn.execute(text("DROP INDEX IF EXISTS ix_conversations_user_updated"))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -6,6 +6,7 @@ CREATE TABLE IF NOT EXISTS users (
     hashed_password VARCHAR(255) NOT NULL,
     full_name VARCHAR(100),
     role VARCHAR(20) DEFAULT 'user' CHECK (role IN ('admin', 'analyst', 'user')),
+    role_level INTEGER NOT NULL DEFAULT 1,  -- admin 3, analyst 2, user 1
     is_active BOOLEAN DEFAULT true,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -42,6 +43,17 @@ CREATE TABLE IF NOT EXISTS analytics (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Daily analytics rollup (rebuilt periodically by the backend)
+CREATE TABLE IF NOT EXISTS analytics_daily (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    day DATE NOT NULL,
+    query_count INTEGER NOT NULL,
+    response_time_total FLOAT,
+    rag_query_count INTEGER NOT NULL,
+    rag_sources_total INTEGER
+);
+
 -- Documents metadata table
 CREATE TABLE IF NOT EXISTS documents (
     id SERIAL PRIMARY KEY,
@@ -62,6 +74,14 @@ CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation
 CREATE INDEX IF NOT EXISTS idx_analytics_user_id ON analytics(user_id);
 CREATE INDEX IF NOT EXISTS idx_analytics_created_at ON analytics(created_at);
 CREATE INDEX IF NOT EXISTS idx_documents_uploaded_by ON documents(uploaded_by);
+CREATE INDEX IF NOT EXISTS ix_messages_conv_created ON messages(conversation_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_conversations_user_updated_id ON conversations(user_id, updated_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_analytics_user_time ON analytics(user_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_analytics_model ON analytics(model_used);
+CREATE INDEX IF NOT EXISTS ix_analytics_daily_day_user ON analytics_daily(day, user_id);
+CREATE INDEX IF NOT EXISTS ix_analytics_query_md5 ON analytics(md5(query), user_id);
+CREATE INDEX IF NOT EXISTS ix_analytics_rag ON analytics(user_id) INCLUDE (rag_sources_used)
+    WHERE rag_sources_used > 0;
 
 -- Create updated_at trigger function
 CREATE OR REPLACE FUNCTION update_updated_at_column()
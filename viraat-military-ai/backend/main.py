@@ -1,36 +1,54 @@
 from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import timedelta
+from datetime import datetime, timedelta
+import asyncio
+import re
 import time
 from loguru import logger
+import orjson
 
 from config import settings
-from database.models import get_db, init_db, User
-from models.llm_handler import llm_handler
-from models.rag_engine import rag_engine
+from database.models import get_db, get_read_db, init_db
+from models.llm_handler import llm_handler, iter_chunks
+from models.rag_engine import rag_engine, RAGResult
+from controllers.visual_controller import visual_controller
 from services.auth_service import auth_service
+from services.auth_cache import auth_cache, CurrentUser
 from services.conversation_service import conversation_service
 from services.analytics_service import analytics_service
 
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson (several times faster than the stdlib encoder).
+
+    Defined here rather than imported: fastapi.responses.ORJSONResponse is deprecated
+    in recent FastAPI releases.
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="VIRAAT Military AI Assistant",
     description="Advanced AI-powered query resolution system for military decision-making",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# Configure CORS
+# Configure CORS: explicit lists avoid wildcard handling per request, and max_age
+# lets browsers reuse a preflight for a day instead of sending OPTIONS each time
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=[origin.strip() for origin in settings.cors_origins.split(",") if origin.strip()],
+    allow_credentials=False,  # bearer tokens are sent in the Authorization header, not cookies
+    allow_methods=["GET", "POST", "PATCH", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
 # Security
@@ -69,9 +87,23 @@ class MessageResponse(BaseModel):
 
 # ==================== Helper Functions ====================
 
+_WORD_RE = re.compile(r'\w+')
+# Short queries made only of these words are greetings: no RAG or visual lookup needed
+_GREETINGS = frozenset({"hi", "hello", "hey", "greetings", "there", "viraat"})
+
+# Legacy in-band directive appended by the decision engine: "[VISUAL_DIRECTIVE: {...}]\n".
+# The body is compact JSON, which cannot contain a raw newline, so "]\n" ends it.
+_DIRECTIVE_MARKER = "[VISUAL_DIRECTIVE:"
+_DIRECTIVE_END = "]\n"
+
+def _is_trivial(query: str) -> bool:
+    """True for short greetings like "Hello there!" that need no knowledge-base lookup."""
+    words = _WORD_RE.findall(query.lower())
+    return 0 < len(words) < 4 and _GREETINGS.issuperset(words)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), 
-                          db: Session = Depends(get_db)) -> User:
-    """Get current authenticated user."""
+                          db: Session = Depends(get_db)) -> CurrentUser:
+    """Get current authenticated user as an immutable CurrentUser snapshot."""
     token = credentials.credentials
     
     # Support mock guest token for development
@@ -79,7 +111,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     logger.debug(f"Auth check: token='{token}', is_dev={is_dev}")
     
     if token == "guest_token_mock" and is_dev:
-        guest_user = auth_service.get_user(db, "guest_warrior")
+        guest_user = auth_service.get_request_user(db, "guest_warrior")
         if not guest_user:
             logger.info("Creating mock guest user")
             guest_user = auth_service.create_user(
@@ -90,8 +122,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                 full_name="Guest Personnel",
                 role="guest"
             )
-        return guest_user
+        return CurrentUser.from_user(guest_user)
 
+    # Signature verification and the user lookup are skipped for recently seen tokens
+    cached = auth_cache.get(token)
+    if cached:
+        return cached[1]
+    
     payload = auth_service.decode_access_token(token)
     
     if not payload:
@@ -107,14 +144,17 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid authentication credentials"
         )
     
-    user = auth_service.get_user(db, username)
+    user = auth_service.get_request_user(db, username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
     
-    return user
+    # Cache a plain snapshot, never the ORM instance: it is shared by concurrent requests
+    current_user = CurrentUser.from_user(user)
+    auth_cache.put(token, payload, current_user)
+    return current_user
 
 # ==================== Routes ====================
 
@@ -124,8 +164,9 @@ async def health_check():
     return {
         "status": "healthy",
         "version": "1.0.0",
-        "llm_initialized": llm_handler.mock_mode or llm_handler.llm is not None,
-        "rag_initialized": True
+        "llm_initialized": llm_handler.initialized,
+        "rag_initialized": True,
+        "rag_context_cache": rag_engine.get_cache_stats()
     }
 
 @app.post("/api/v1/auth/register", response_model=Token)
@@ -169,17 +210,17 @@ async def login(login_data: UserLogin, db: Session = Depends(get_db)):
     }
 
 @app.get("/api/v1/conversations")
-async def get_conversations(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get all conversations for the current user."""
-    return conversation_service.get_user_conversations(db, current_user.id)
+async def get_conversations(before: Optional[datetime] = None, before_id: Optional[int] = None, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get the current user's conversations; pass the last row's updated_at and id as `before` and `before_id` for the next page."""
+    return conversation_service.get_user_conversations(db, current_user.id, before=before, before_id=before_id)
 
 @app.post("/api/v1/conversations")
-async def create_conversation(conv_data: ConversationCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_conversation(conv_data: ConversationCreate, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Create a new conversation."""
     return conversation_service.create_conversation(db, current_user.id, conv_data.title)
 
 @app.delete("/api/v1/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_conversation(conversation_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Delete a conversation."""
     success = conversation_service.delete_conversation(db, conversation_id, current_user.id)
     if not success:
@@ -187,7 +228,7 @@ async def delete_conversation(conversation_id: int, current_user: User = Depends
     return {"status": "success"}
 
 @app.patch("/api/v1/conversations/{conversation_id}")
-async def update_conversation(conversation_id: int, conv_data: ConversationCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_conversation(conversation_id: int, conv_data: ConversationCreate, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Update conversation title."""
     conversation = conversation_service.update_conversation_title(db, conversation_id, current_user.id, conv_data.title)
     if not conversation:
@@ -195,63 +236,65 @@ async def update_conversation(conversation_id: int, conv_data: ConversationCreat
     return conversation
 
 @app.get("/api/v1/conversations/{conversation_id}/messages")
-async def get_messages(conversation_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_messages(conversation_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get all messages in a conversation."""
     return conversation_service.get_conversation_messages(db, conversation_id)
 
 @app.post("/api/v1/chat")
-async def chat(request: ChatRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def chat(request: ChatRequest, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Chat endpoint for AI response."""
     start_time = time.time()
+    trivial = _is_trivial(request.query)
     
-    # Get conversation context
-    history = []
-    if request.conversation_id:
-        history = conversation_service.get_conversation_history(db, request.conversation_id)
+    # Conversation history (DB read) and RAG lookup (CPU-bound) run concurrently in
+    # the threadpool; only the history call touches the session
+    async def load_history():
+        if not request.conversation_id:
+            return []
+        return await run_in_threadpool(conversation_service.get_conversation_history, db, request.conversation_id)
+    
+    async def load_context():
+        if not request.use_rag or trivial:
+            return RAGResult("", ())
+        return await run_in_threadpool(rag_engine.search_and_format, request.query)
     
-    # RAG lookup if requested
-    context = ""
-    sources_count = 0
-    if request.use_rag:
-        # rag_results = rag_engine.search(request.query) # Deprecated direct call
-        context = rag_engine.get_context_for_query(request.query)
-        # sources_count is roughly number of refs, but we can't easily get it from string. 
-        # For analytics, we can do a quick count or just search again if needed, 
-        # but better to just count the refs in string.
-        sources_count = context.count("[Ref ")
+    history, rag = await asyncio.gather(load_history(), load_context())
+    sources_count = rag.sources_count
     
     # Get LLM response
-    response_text = await llm_handler.generate_response(request.query, context, history)
+    response_text = await llm_handler.generate_response(request.query, rag.context, history, refs=rag.refs)
     
     # Extract visual directive (backend now produces structured JSON)
     visual_directive = None
     
     # Check if response contains visual marker (legacy support)
-    if "[VISUAL_DIRECTIVE:" in response_text:
-        marker_idx = response_text.index("[VISUAL_DIRECTIVE:")
-        end_idx = response_text.rfind("]")
-        if end_idx > marker_idx:
+    marker_idx = response_text.find(_DIRECTIVE_MARKER)
+    if marker_idx != -1:
+        json_start = marker_idx + len(_DIRECTIVE_MARKER)
+        json_end = response_text.find(_DIRECTIVE_END, json_start)
+        if json_end != -1:
             try:
-                import json as json_module
-                json_str = response_text[marker_idx+17:end_idx]
-                visual_directive = json_module.loads(json_str)
+                visual_directive = orjson.loads(response_text[json_start:json_end])
                 response_text = response_text[:marker_idx].strip()
-            except Exception:
+            except orjson.JSONDecodeError:
                 pass
     
     # Alternatively, analyze query for visual intent
-    if not visual_directive:
+    if not visual_directive and not trivial:
         visual_intent = visual_controller.analyze(request.query)
         if visual_intent:
             visual_directive = visual_intent
     
-    # Log user message
-    if request.conversation_id:
-        conversation_service.add_message(db, request.conversation_id, "user", request.query)
-        conversation_service.add_message(db, request.conversation_id, "assistant", response_text)
-    
-    # Log analytics
+    # Record the exchange: both messages in one INSERT, off the event loop. Analytics
+    # only enqueues the row; the background writer inserts it with the next batch.
     response_time = time.time() - start_time
+    
+    if request.conversation_id:
+        await run_in_threadpool(
+            conversation_service.add_messages_bulk,
+            db, request.conversation_id,
+            [("user", request.query), ("assistant", response_text)]
+        )
     analytics_service.log_query(
         db, 
         current_user.id, 
@@ -261,15 +304,32 @@ async def chat(request: ChatRequest, current_user: User = Depends(get_current_us
         rag_sources_used=sources_count
     )
     
+    if request.stream:
+        return StreamingResponse(
+            _sse_events(response_text, sources_count, visual_directive),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     return {
         "response": response_text,
         "sources_count": sources_count,
         "visual_directive": visual_directive
     }
 
+async def _sse_events(response_text: str, sources_count: int, visual_directive: Optional[dict]):
+    """Server-sent events for a streamed chat reply: one event per line, then a final summary."""
+    for chunk in iter_chunks(response_text):
+        yield b"data: " + orjson.dumps({'chunk': chunk}) + b"\n\n"
+    yield b"data: " + orjson.dumps({'done': True, 'sources_count': sources_count, 'visual_directive': visual_directive}) + b"\n\n"
+
 @app.get("/api/v1/analytics/dashboard")
-async def get_analytics(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get analytics dashboard stats."""
+async def get_analytics(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    """Get analytics dashboard stats.
+    
+    Totals are live; queries_last_7_days is read from the periodic daily rollup, so it
+    counts whole days and can trail total_queries by up to analytics_rollup_interval.
+    """
     # Allow all users to see their own stats, or admin to see everything
     user_id = None if current_user.role == "admin" else current_user.id
     return analytics_service.get_dashboard_stats(db, user_id)
@@ -277,10 +337,27 @@ async def get_analytics(current_user: User = Depends(get_current_user), db: Sess
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    analytics_service.start_writer()
+    analytics_service.start_rollup()
     await llm_handler.initialize()
     await rag_engine.initialize()
     logger.info("Application started, database initialized, and LLM model loaded")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await analytics_service.stop_rollup()
+    await analytics_service.stop_writer()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvicorn[standard] installs uvloop (not on Windows) and httptools; "auto" selects
+    # them when present and falls back to asyncio/h11 otherwise. Multiple workers need
+    # the app as an import string.
+    uvicorn.run(
+        "main:app",
+        host=settings.api_host,
+        port=settings.api_port,
+        loop="auto",
+        http="auto",
+        workers=settings.web_concurrency,
+    )
@@ -1,11 +1,46 @@
-from typing import Dict, List, Optional, AsyncIterator
-import asyncio
+from typing import Dict, List, Optional, AsyncIterator, Iterator, Sequence, Tuple
 from loguru import logger
 from config import settings
 from controllers.visual_controller import visual_controller
 import random
 import re
-import json
+import orjson
+
+
+# Sentence boundary after '.' or '?', skipping abbreviations like "e.g." and "Mr."
+_SENT_SPLIT = re.compile(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s')
+_WORD_RE = re.compile(r'\w+')
+# Query words too common to count as matches
+_STOP = frozenset({'what', 'are', 'is', 'the', 'a', 'an', 'in', 'on', 'of', 'to'})
+# One line including its trailing newline, or a final unterminated line
+_LINE_RE = re.compile(r'[^\n]*\n|[^\n]+')
+# Persona intro templates; only the chosen one is formatted with the query
+_INTROS = (
+    "Commander, I have analyzed the intelligence database regarding **'{q}'** and found the following:",
+    "Strategic Report: Analysis of **'{q}'** complete. Accessing classified directives:",
+    "VIRAAT System Active. Retrieving technical specifications for **'{q}'**:",
+)
+
+
+def iter_chunks(text: str) -> Iterator[str]:
+    """Yield text line by line (newlines kept) so markdown blocks arrive whole."""
+    for match in _LINE_RE.finditer(text):
+        yield match.group()
+
+
+def query_terms(query: str) -> frozenset:
+    """Distinct lowercase words of the query, minus stopwords."""
+    return frozenset(_WORD_RE.findall(query.lower())) - _STOP
+
+
+def get_best_sentence(text: str, terms: frozenset) -> str:
+    """Return the first sentence of text sharing the most words with terms."""
+    sentences = _SENT_SPLIT.split(text)
+    if not sentences: return text[:100] + "..."
+    
+    # One tokenization per sentence and a set intersection, no per-term substring scans
+    best_sent = max(sentences, key=lambda sent: len(terms.intersection(_WORD_RE.findall(sent.lower()))))
+    return best_sent.strip()
 
 
 class LLMHandler:
@@ -33,17 +68,20 @@ class LLMHandler:
         query: str,
         context: Optional[str] = None,
         conversation_history: Optional[List[Dict]] = None,
-        stream: bool = False
+        stream: bool = False,
+        refs: Sequence[Tuple[str, float, str]] = ()
     ) -> str:
-        """Generate response using the Decision Engine algorithm."""
-        await asyncio.sleep(0.5) # Slight delay to feel like 'AI processing'
-        
+        """Generate response using the Decision Engine algorithm.
+
+        refs are the (source, similarity, content) entries returned alongside context
+        by rag_engine.search_and_format().
+        """
         if not context or len(context.strip()) < 10:
             return self._generate_fallback_response(query)
             
-        return self._structure_context_response(query, context, conversation_history)
+        return self._structure_context_response(query, refs, conversation_history)
     
-    def _structure_context_response(self, query: str, context: str, history: Optional[List[Dict]]) -> str:
+    def _structure_context_response(self, query: str, refs: Sequence[Tuple[str, float, str]], history: Optional[List[Dict]]) -> str:
         """Algorithmic response structuring with Persona and Visuals."""
         
         # 1. Analyze for Visual Intent
@@ -52,38 +90,9 @@ class LLMHandler:
         if visual_directive:
             # We encode the directive as a hidden JSON-like block or special marker for the frontend
             # Format: [VISUAL_DIRECTIVE: {"model_id": "..."}]
-            visual_block = f"\n\n[VISUAL_DIRECTIVE: {json.dumps(visual_directive)}]\n"
+            visual_block = f"\n\n[VISUAL_DIRECTIVE: {orjson.dumps(visual_directive).decode()}]\n"
 
-        # Extract snippets from context (Refs)
-        logger.info(f"LLMHandler Received Context ({len(context)} chars). Preview: {context[:100]}...")
-        
-        # Robust parsing: Split by "[Ref "
-        refs = []
-        if "[Ref " in context:
-            parts = context.split("\n\n[Ref ")
-            # Handle first part (which might be just "[Ref " if it starts with it)
-            if context.startswith("[Ref "):
-                parts[0] = parts[0][5:] # Remove initial "[Ref "
-            
-            for p in parts:
-                # Format: "1: source, Relevance: 0.xx]\nContent"
-                try:
-                    meta_part, content_part = p.split("]\n", 1)
-                    if "Relevance:" in meta_part:
-                         # Extract source (everything before ", Relevance")
-                         # Meta: "1: filename.md, Relevance: 0.50"
-                         source_str = meta_part.split(", Relevance:")[0]
-                         source = source_str.split(": ", 1)[1] if ": " in source_str else source_str
-                         
-                         rel_str = meta_part.split("Relevance: ")[1]
-                         rel = float(rel_str)
-                         
-                         refs.append((source, rel, content_part))
-                except Exception:
-                    continue
-        else:
-            # Fallback for legacy format or single chunk
-             refs = []
+        logger.info(f"LLMHandler Received {len(refs)} context refs")
 
         # 2. Persona Engine: Generate Intro
         intro = self._generate_persona_intro(query, bool(refs))
@@ -93,27 +102,10 @@ class LLMHandler:
         if refs:
             response += "#### Key Intelligence Points:\n"
             
-            # Helper to find best sentence
-            def get_best_sentence(text, query):
-                sentences = re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s', text)
-                if not sentences: return text[:100] + "..."
-                
-                query_terms = set(re.findall(r'\w+', query.lower())) - {'what', 'are', 'is', 'the', 'a', 'an', 'in', 'on', 'of', 'to'}
-                best_sent = sentences[0]
-                max_score = 0
-                
-                for sent in sentences:
-                    sent_lower = sent.lower()
-                    score = sum(1 for term in query_terms if term in sent_lower)
-                    if score > max_score:
-                        max_score = score
-                        best_sent = sent
-                        
-                return best_sent.strip()
-
+            terms = query_terms(query)
             for source, rel, content in refs[:3]: # Top 3 points
                 # Smart summary: Find sentence with most query terms
-                best_sentence = get_best_sentence(content, query)
+                best_sentence = get_best_sentence(content, terms)
                 response += f"- **{source}**: {best_sentence}\n"
             
             # Determine top score for dynamic filtering
@@ -121,7 +113,7 @@ class LLMHandler:
             
             response += "\n#### Detailed Analysis:\n"
             
-            seen_content = set()
+            # Refs are distinct: the RAG engine deduplicates chunks when indexing
             for source, rel, content in refs:
                 current_score = float(rel)
                 
@@ -131,14 +123,9 @@ class LLMHandler:
                 if current_score < (top_score * 0.8):
                     continue
                     
-                clean_content = content.strip()
-                
-                # Deduplication logic (check start of content)
-                if clean_content[:50] not in seen_content:
-                    response += f"**From {source}**:\n"
-                    # Preserve formatting by just printing content
-                    response += f"{clean_content}\n\n"
-                    seen_content.add(clean_content[:50])
+                response += f"**From {source}**:\n"
+                # Preserve formatting by just printing content
+                response += f"{content.strip()}\n\n"
         else:
              response += self._generate_persona_fallback()
              
@@ -154,12 +141,7 @@ class LLMHandler:
         if not has_data:
             return "Commander, my strategic assessment yielded no specific matches in the current database."
             
-        intros = [
-            f"Commander, I have analyzed the intelligence database regarding **'{query}'** and found the following:",
-            f"Strategic Report: Analysis of **'{query}'** complete. Accessing classified directives:",
-            f"VIRAAT System Active. Retrieving technical specifications for **'{query}'**:",
-        ]
-        return random.choice(intros)
+        return random.choice(_INTROS).format(q=query)
 
     def _generate_persona_fallback(self) -> str:
         return "\n\nMy archives do not contain specific tactical data on this subject. Recommendation: Verify the terminology or request a broader strategic overview."
@@ -180,17 +162,15 @@ class LLMHandler:
         self,
         query: str,
         context: Optional[str] = None,
-        conversation_history: Optional[List[Dict]] = None
+        conversation_history: Optional[List[Dict]] = None,
+        refs: Sequence[Tuple[str, float, str]] = ()
     ) -> AsyncIterator[str]:
         """Generate streaming response using the Decision Engine."""
-        full_response = await self.generate_response(query, context, conversation_history)
+        full_response = await self.generate_response(query, context, conversation_history, refs=refs)
         
-        # Simulate streaming by Yielding chunks
-        words = full_response.split(" ")
-        for i in range(0, len(words), 3):
-            chunk = " ".join(words[i:i+3]) + " "
+        # The response is already complete: emit it line by line without delays
+        for chunk in iter_chunks(full_response):
             yield chunk
-            await asyncio.sleep(0.02)
     
     def get_model_info(self) -> Dict:
         """Get information about the 'model' (algorithm)."""
@@ -1,13 +1,54 @@
+import functools
+import hashlib
 import os
 import glob
-from typing import List, Dict, Optional
+from collections import Counter
+from dataclasses import dataclass
+from itertools import chain
+from typing import List, Dict, Optional, Tuple
 from loguru import logger
 from config import settings
+import joblib
+import sklearn
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
 
+# Bump when the chunking or vectorizer setup changes so cached indexes are rebuilt
+_INDEX_CACHE_VERSION = 3
+
+
+# Military/general synonyms appended to matching query terms to improve recall
+_SYNONYM_MAP = {
+    "gun": "gun weapon rifle firearm pistol arm",
+    "guns": "guns weapons rifles firearms pistols arms",
+    "soldier": "soldier personnel infantry troop",
+    "communications": "communications comms signals radio",
+    "tank": "tank armor vehicle mb",
+    "plane": "plane aircraft jet fighter",
+    "assemble": "assemble build construct setup maintenance",
+    "how": "how procedure steps guide protocol"
+}
+
+# Full replacement for each expandable word: the word itself followed by its synonyms
+_SYNONYM_EXPANSIONS = {word: (word, *synonyms.split()) for word, synonyms in _SYNONYM_MAP.items()}
+
+
+@dataclass(frozen=True)
+class RAGResult:
+    """Formatted context plus the (source, similarity, content) refs it was built from."""
+    context: str
+    refs: Tuple[Tuple[str, float, str], ...]
+
+    @property
+    def sources_count(self) -> int:
+        return len(self.refs)
+
+
+_EMPTY_RESULT = RAGResult("", ())
+
+
 class RAGEngine:
     """Retrieval Augmented Generation engine using TF-IDF (No models/No API keys)."""
     
@@ -17,12 +58,49 @@ class RAGEngine:
             ngram_range=(1, 2),
             max_df=0.8,
             min_df=1,
-            sublinear_tf=True  # Apply sublinear tf scaling, i.e. replace tf with 1 + log(tf).
+            sublinear_tf=True,  # Apply sublinear tf scaling, i.e. replace tf with 1 + log(tf).
+            dtype=np.float32  # half the memory/bandwidth of float64; ample precision for ranking
         )
         self.documents = []
         self.metadatas = []
         self.tfidf_matrix = None
+        # Inverted index over tfidf_matrix: per-term (CSC column) doc ids and weights
+        self._postings = None
+        self._analyzer = None
+        self._idf = None
         self.is_initialized = False
+        # (cache dir, fingerprint) that initialize() loads the index from and saves it under
+        self._index_cache: Optional[Tuple[str, str]] = None
+
+        # Formatted context per normalized query; valid until the corpus changes
+        self._context_cache = functools.lru_cache(maxsize=2048)(self._build_result)
+
+    def _build_search_index(self):
+        """Build the inverted index scored by search().
+
+        Column t of the CSC matrix is the posting list of term t: the ids of the
+        documents containing it and their (row-normalized) TF-IDF weights.
+        """
+        postings = self.tfidf_matrix.tocsc()
+        postings.sort_indices()
+        self._postings = postings
+        self._analyzer = self.vectorizer.build_analyzer()
+        self._idf = self.vectorizer.idf_.astype(np.float32, copy=False)
+
+    def _query_weights(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorize a query the way TfidfVectorizer.transform does, as (term ids, weights).
+
+        Tokens come from the fitted analyzer (same stopwords and n-grams); weights use
+        sublinear tf * idf and are L2-normalized, so scores are cosine similarities.
+        """
+        vocabulary = self.vectorizer.vocabulary_
+        counts = Counter(vocabulary[tok] for tok in self._analyzer(text) if tok in vocabulary)
+        if not counts:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        term_ids = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        weights = (1 + np.log(tf)) * self._idf[term_ids]
+        return term_ids, weights / np.linalg.norm(weights)
         
     async def initialize(self):
         """Initialize the TF-IDF engine by indexing local military knowledge base."""
@@ -31,22 +109,39 @@ class RAGEngine:
             
             # Load documents from knowledge-base sources
             kb_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "knowledge-base", "sources")
+            cache_dir = os.path.join(kb_path, ".cache")
+            fingerprint = None
+            loaded = False
             if not os.path.exists(kb_path):
                 logger.warning(f"Knowledge-base sources not found at {kb_path}")
                 # Create a minimal document if missing to avoid failure
                 self.add_document("VIRAAT Military AI: Advanced query resolution system for military decision-making.", {"source": "system"})
             else:
                 md_files = glob.glob(os.path.join(kb_path, "*.md"))
-                for file_path in md_files:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        # Simple chunking by paragraph or section
-                        chunks = [c.strip() for c in content.split("\n\n") if len(c.strip()) > 50]
-                        for chunk in chunks:
-                            self.add_document(chunk, {"source": os.path.basename(file_path)})
+                fingerprint = self._index_fingerprint(md_files)
+                self._index_cache = (cache_dir, fingerprint)
+                loaded = self._load_index(cache_dir, fingerprint)
+                if not loaded:
+                    seen = set()  # content digests: identical paragraphs are indexed once
+                    for file_path in md_files:
+                        with open(file_path, 'r', encoding='utf-8') as f:
+                            content = f.read()
+                            # Simple chunking by paragraph or section
+                            chunks = [c.strip() for c in content.split("\n\n") if len(c.strip()) > 50]
+                            for chunk in chunks:
+                                digest = hashlib.blake2b(chunk.encode('utf-8'), digest_size=8).digest()
+                                if digest in seen:
+                                    continue
+                                seen.add(digest)
+                                self.add_document(chunk, {"source": os.path.basename(file_path)})
             
             if self.documents:
-                self.tfidf_matrix = self.vectorizer.fit_transform(self.documents)
+                if not loaded:
+                    self.tfidf_matrix = self.vectorizer.fit_transform(self.documents)
+                    if fingerprint:
+                        self._save_index(cache_dir, fingerprint)
+                self._build_search_index()
+                self._context_cache.cache_clear()
                 self.is_initialized = True
                 logger.info(f"✓ RAG engine initialized. Indexed {len(self.documents)} document chunks.")
             else:
@@ -58,32 +153,90 @@ class RAGEngine:
             logger.error(f"Error initializing RAG engine: {str(e)}")
             return False
     
+    @staticmethod
+    def _index_fingerprint(md_files: List[str]) -> str:
+        """Identify a knowledge-base state by its files' paths, mtimes and sizes."""
+        state = sorted((p, os.path.getmtime(p), os.path.getsize(p)) for p in md_files)
+        key = repr((_INDEX_CACHE_VERSION, sklearn.__version__, state))
+        return hashlib.sha1(key.encode()).hexdigest()
+    
+    def _load_index(self, cache_dir: str, fingerprint: str) -> bool:
+        """Load a previously fitted index for this fingerprint; False on a miss."""
+        state_path = os.path.join(cache_dir, f"{fingerprint}.joblib")
+        matrix_path = os.path.join(cache_dir, f"{fingerprint}.npz")
+        if not (os.path.exists(state_path) and os.path.exists(matrix_path)):
+            return False
+        try:
+            vectorizer, documents, metadatas = joblib.load(state_path, mmap_mode='r')
+            tfidf_matrix = sparse.load_npz(matrix_path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable RAG index cache {fingerprint}: {str(e)}")
+            return False
+        
+        self.vectorizer = vectorizer
+        self.documents = documents
+        self.metadatas = metadatas
+        self.tfidf_matrix = tfidf_matrix
+        logger.info(f"Loaded cached RAG index {fingerprint[:12]} ({len(documents)} chunks)")
+        return True
+    
+    def _save_index(self, cache_dir: str, fingerprint: str) -> bool:
+        """Persist the fitted index, replacing caches of older knowledge-base states."""
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            for name in os.listdir(cache_dir):
+                if not name.startswith(fingerprint):
+                    os.remove(os.path.join(cache_dir, name))
+            # Write the matrix first: the .joblib file marks a complete entry
+            sparse.save_npz(os.path.join(cache_dir, f"{fingerprint}.npz"), self.tfidf_matrix)
+            state_path = os.path.join(cache_dir, f"{fingerprint}.joblib")
+            joblib.dump((self.vectorizer, self.documents, self.metadatas), state_path + ".tmp")
+            os.replace(state_path + ".tmp", state_path)
+        except OSError as e:
+            logger.warning(f"Could not write RAG index cache: {str(e)}")
+            return False
+        return True
+    
     def add_document(self, document: str, metadata: Optional[Dict] = None):
         """Add a document chunk to the internal store."""
         self.documents.append(document)
         self.metadatas.append(metadata or {})
+        self._context_cache.cache_clear()
     
-    def _expand_synonyms(self, query: str) -> str:
-        """Expand query terms with military/general synonyms to improve recall."""
-        synonym_map = {
-            "gun": "gun weapon rifle firearm pistol arm",
-            "guns": "guns weapons rifles firearms pistols arms",
-            "soldier": "soldier personnel infantry troop",
-            "communications": "communications comms signals radio",
-            "tank": "tank armor vehicle mb",
-            "plane": "plane aircraft jet fighter",
-            "assemble": "assemble build construct setup maintenance",
-            "how": "how procedure steps guide protocol"
-        }
-        
-        words = query.lower().split()
-        expanded_words = []
-        for word in words:
-            expanded_words.append(word)
-            if word in synonym_map:
-                expanded_words.append(synonym_map[word])
+    def add_documents_batch(self, documents: List[str], metadatas: Optional[List[Dict]] = None,
+                            ids: Optional[List[str]] = None) -> bool:
+        """Add a batch of document chunks; call build_index() once all batches are in."""
+        metadatas = metadatas or [{} for _ in documents]
+        if ids:
+            metadatas = [dict(meta, id=doc_id) for meta, doc_id in zip(metadatas, ids)]
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+        self._context_cache.cache_clear()
+        return True
+    
+    def build_index(self) -> bool:
+        """Fit TF-IDF over the current documents, rebuild the search index and persist it.
         
-        return " ".join(expanded_words)
+        The index is saved under the cache entry initialize() loads, so batches added
+        since then are served after a restart. False if it could not be built or saved.
+        """
+        if not self.documents:
+            return False
+        self.tfidf_matrix = self.vectorizer.fit_transform(self.documents)
+        self._build_search_index()
+        self._context_cache.cache_clear()
+        self.is_initialized = True
+        if self._index_cache is None:
+            return True
+        return self._save_index(*self._index_cache)
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=2048)
+    def _expand_synonyms(query: str) -> str:
+        """Expand query terms with military/general synonyms to improve recall."""
+        return " ".join(chain.from_iterable(
+            _SYNONYM_EXPANSIONS.get(word, (word,)) for word in query.lower().split()
+        ))
     
     def search(self, query: str, top_k: Optional[int] = None) -> List[Dict]:
         """Search for relevant documents using Cosine Similarity on TF-IDF vectors (Synchronous)."""
@@ -98,14 +251,21 @@ class RAGEngine:
             expanded_query = self._expand_synonyms(query)
             logger.info(f"Original Query: '{query}' -> Expanded: '{expanded_query}'")
 
-            # Generate query vector
-            query_vec = self.vectorizer.transform([expanded_query])
+            # Generate query vector (L2-normalized, like the document rows)
+            term_ids, weights = self._query_weights(expanded_query)
             
-            # Compute cosine similarity
-            cosine_sim = cosine_similarity(query_vec, self.tfidf_matrix).flatten()
+            # Compute cosine similarity by accumulating only the query terms' postings
+            cosine_sim = np.zeros(self._postings.shape[0], dtype=np.float32)
+            indptr, indices, data = self._postings.indptr, self._postings.indices, self._postings.data
+            for term_id, weight in zip(term_ids, weights):
+                start, end = indptr[term_id], indptr[term_id + 1]
+                # A document appears at most once per posting list, so plain += is safe
+                cosine_sim[indices[start:end]] += weight * data[start:end]
             
-            # Get top k indices
-            top_indices = cosine_sim.argsort()[-k:][::-1]
+            # Get top k indices: O(n) partition, then order only the k winners
+            k = min(k, cosine_sim.shape[0])
+            top_indices = np.argpartition(cosine_sim, -k)[-k:]
+            top_indices = top_indices[np.argsort(cosine_sim[top_indices])[::-1]]
             
             # Format results
             formatted_results = []
@@ -135,16 +295,30 @@ class RAGEngine:
             logger.error(f"Error searching: {str(e)}")
             return []
     
+    def search_and_format(self, query: str, top_k: Optional[int] = None) -> RAGResult:
+        """Search once and return both the formatted context and its structured refs."""
+        # Case and whitespace do not change the result (the vectorizer lowercases)
+        query_norm = " ".join(query.lower().split())
+        return self._context_cache(query_norm, top_k)
+    
     def get_context_for_query(self, query: str, top_k: Optional[int] = None) -> str:
         """Get formatted context string for the decision engine."""
+        return self.search_and_format(query, top_k).context
+    
+    def _build_result(self, query: str, top_k: Optional[int] = None) -> RAGResult:
+        """Uncached part of search_and_format()."""
+        if not query:
+            return _EMPTY_RESULT
+        
         # Search for relevant documents (Synchronous)
         results = self.search(query, top_k)
         
         if not results:
-            return ""
+            return _EMPTY_RESULT
         
-        # Format context
+        # Format context; refs carry the same data so consumers need not parse the string
         context_parts = []
+        refs = []
         for i, result in enumerate(results, 1):
             content = result['content']
             similarity = result['similarity']
@@ -154,9 +328,10 @@ class RAGEngine:
             context_parts.append(
                 f"[Ref {i}: {source}, Relevance: {similarity:.2f}]\n{content}"
             )
+            refs.append((source, similarity, content))
         
-        context = "\n\n".join(context_parts)
-        return context
+        # Immutable: the result is cached and shared between callers
+        return RAGResult("\n\n".join(context_parts), tuple(refs))
     
     def get_stats(self) -> Dict:
         """Get engine statistics."""
@@ -165,6 +340,17 @@ class RAGEngine:
             "document_count": len(self.documents),
             "is_initialized": self.is_initialized
         }
+    
+    def get_cache_stats(self) -> Dict:
+        """Get context cache hit/miss counters."""
+        info = self._context_cache.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0
+        }
 
 
 # Global RAG engine instance
@@ -1,34 +1,239 @@
-from typing import Optional
+import asyncio
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
-from database.models import Analytics
-from datetime import datetime, timedelta
+from database.models import Analytics, AnalyticsDaily, SessionLocal, User
+from datetime import datetime, timedelta, timezone
 from loguru import logger
-from sqlalchemy import func
+from sqlalchemy import func, text, bindparam, case, delete, insert, select, update, Date
+from config import settings
+
+
+# Every dashboard figure in one statement: one tagged row set per section, combined
+# with UNION ALL so it runs on both SQLite and PostgreSQL. Each section reads the base
+# table directly, so PostgreSQL can serve it from its own index: the per-user variant
+# filters on the indexed user_id column, the RAG aggregate uses the predicate of the
+# partial index ix_analytics_rag, and popular queries across all users are grouped by
+# md5(query), a short fixed-size key served in order by ix_analytics_query_md5, with
+# min(query) as the representative text.
+# Per-day counts come from the analytics_daily rollup instead of the base table.
+# Placeholder NULLs are cast explicitly: PostgreSQL types a bare NULL in a subquery's
+# output as text, which cannot be unioned with the float `val` column.
+_DASHBOARD_SQL = """
+SELECT 'totals' AS section, CAST(NULL AS TEXT) AS label, count(*) AS n,
+       CAST(avg(response_time) AS FLOAT) AS val FROM analytics {where}
+UNION ALL
+SELECT 'rag', CAST(NULL AS TEXT), count(*), CAST(avg(rag_sources_used) AS FLOAT)
+FROM analytics WHERE rag_sources_used > 0 {user_filter}
+UNION ALL
+SELECT * FROM (
+    SELECT 'popular', CAST({popular_label} AS TEXT), count(*), CAST(NULL AS FLOAT)
+    FROM analytics {where}
+    GROUP BY {popular_key} ORDER BY count(*) DESC LIMIT :popular_limit
+) AS popular
+UNION ALL
+SELECT 'day', CAST(day AS TEXT), sum(query_count), CAST(NULL AS FLOAT) FROM analytics_daily
+WHERE day >= :since {user_filter} GROUP BY day
+"""
+
+
+def _dashboard_statement(where: str, user_filter: str, popular_label: str, popular_key: str):
+    sql = _DASHBOARD_SQL.format(where=where, user_filter=user_filter,
+                                popular_label=popular_label, popular_key=popular_key)
+    return text(sql).bindparams(bindparam("since", type_=Date))
+
+
+def _dashboard_statements(popular_label: str, popular_key: str):
+    """(all users, one user) dashboard statements; popular_* group the all-users one.
+    
+    One user's queries are a small slice found through user_id, cheaper to group by text.
+    """
+    return (
+        _dashboard_statement("", "", popular_label, popular_key),
+        _dashboard_statement("WHERE user_id = :uid", "AND user_id = :uid", "query", "query"),
+    )
+
+
+_DASHBOARD = {
+    "postgresql": _dashboard_statements("min(query)", "md5(query)"),
+    None: _dashboard_statements("query", "query"),
+}
+
+# analytics grouped by (user, day) in the shape of AnalyticsDaily
+_ROLLUP_DAY = func.date(Analytics.created_at)
+_ROLLUP_IS_RAG = Analytics.rag_sources_used > 0
+_ROLLUP_SOURCE = select(
+    Analytics.user_id,
+    _ROLLUP_DAY,
+    func.count(Analytics.id),
+    func.sum(Analytics.response_time),
+    func.count(case((_ROLLUP_IS_RAG, 1))),
+    func.sum(case((_ROLLUP_IS_RAG, Analytics.rag_sources_used)))
+).group_by(Analytics.user_id, _ROLLUP_DAY)
+_ROLLUP_COLUMNS = ["user_id", "day", "query_count", "response_time_total",
+                   "rag_query_count", "rag_sources_total"]
+# Every worker runs its own refresher; on PostgreSQL this transaction-scoped advisory
+# lock lets one refresh at a time through and the others skip instead of repeating it
+_ROLLUP_LOCK = text("SELECT pg_try_advisory_xact_lock(:key)").bindparams(key=0x76726174)
 
 
 class AnalyticsService:
     """Service for tracking and analyzing usage."""
     
-    @staticmethod
-    def log_query(db: Session, user_id: Optional[int], query: str, 
+    def __init__(self):
+        # Write-behind queue: log_query enqueues rows, a background task inserts them in batches
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._rollup: Optional[asyncio.Task] = None
+    
+    def log_query(self, db: Session, user_id: Optional[int], query: str, 
                  response_time: float, model_used: str, 
                  tokens_used: Optional[int] = None,
-                 rag_sources_used: Optional[int] = None) -> Analytics:
-        """Log a query for analytics."""
-        analytics = Analytics(
+                 rag_sources_used: Optional[int] = None) -> None:
+        """Log a query for analytics.
+        
+        Fire-and-forget once the writer is running; safe to call from the event loop
+        or a threadpool worker. Without a writer the row is inserted directly on `db`.
+        """
+        row = dict(
             user_id=user_id,
             query=query,
             response_time=response_time,
             model_used=model_used,
             tokens_used=tokens_used,
-            rag_sources_used=rag_sources_used
+            rag_sources_used=rag_sources_used,
+            # The queue writes this row up to a flush interval later (longer under load), so
+            # the server default would record the batch's insert time; stamp the query time now
+            created_at=datetime.now(timezone.utc)
         )
         
-        db.add(analytics)
-        db.commit()
-        db.refresh(analytics)
+        if self._writer is None:
+            db.bulk_insert_mappings(Analytics, [row])
+            db.commit()
+            return
+        
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, row)
+    
+    def start_writer(self) -> None:
+        """Start the background batch writer on the running event loop."""
+        if self._writer is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._writer = self._loop.create_task(self._run_writer())
+    
+    async def stop_writer(self) -> None:
+        """Stop the batch writer and flush anything still queued."""
+        if self._writer is None:
+            return
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+        
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            self._write_batch(batch)
+    
+    async def _run_writer(self) -> None:
+        """Drain the queue in batches of up to analytics_batch_size rows or one flush interval."""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + settings.analytics_flush_interval
+            try:
+                while len(batch) < settings.analytics_batch_size:
+                    timeout = deadline - self._loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Shutting down mid-batch: write what was already taken off the queue
+                self._write_batch(batch)
+                raise
+            # The insert is blocking; keep it off the event loop
+            await self._loop.run_in_executor(None, self._write_batch, batch)
+    
+    @staticmethod
+    def _write_batch(batch: List[Dict]) -> None:
+        """Insert a batch of analytics rows in one executemany and one commit."""
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(Analytics, batch)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to write {len(batch)} analytics rows: {e}")
+        finally:
+            db.close()
+    
+    def start_rollup(self) -> None:
+        """Rebuild analytics_daily now and then every analytics_rollup_interval seconds."""
+        if self._rollup is None:
+            self._rollup = asyncio.get_running_loop().create_task(self._run_rollup())
+    
+    async def stop_rollup(self) -> None:
+        """Stop the periodic rollup rebuild."""
+        if self._rollup is None:
+            return
+        self._rollup.cancel()
+        try:
+            await self._rollup
+        except asyncio.CancelledError:
+            pass
+        self._rollup = None
+    
+    async def _run_rollup(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self._refresh_rollup)
+            await asyncio.sleep(settings.analytics_rollup_interval)
+    
+    @staticmethod
+    def _refresh_rollup() -> None:
+        db = SessionLocal()
+        try:
+            AnalyticsService.refresh_daily_rollup(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to refresh analytics_daily: {e}")
+        finally:
+            db.close()
+    
+    @staticmethod
+    def refresh_daily_rollup(db: Session) -> bool:
+        """Bring analytics_daily up to date with analytics in one transaction.
+        
+        Only days from the one before the latest rolled-up day onward are re-aggregated:
+        earlier days are complete, and the extra day picks up rows queued just before
+        midnight. Readers keep seeing the previous rollup until the commit. Returns
+        False without doing anything while another worker is refreshing (PostgreSQL).
+        """
+        if db.get_bind().dialect.name == "postgresql" and not db.execute(_ROLLUP_LOCK).scalar():
+            db.rollback()
+            return False
         
-        return analytics
+        source = _ROLLUP_SOURCE
+        last_day = db.execute(select(func.max(AnalyticsDaily.day))).scalar()
+        if last_day is not None:
+            since = last_day - timedelta(days=1)
+            db.execute(delete(AnalyticsDaily).where(AnalyticsDaily.day >= since))
+            source = source.where(Analytics.created_at >= datetime.combine(since, datetime.min.time()))
+            # Deleting a user nulls analytics.user_id; follow it on the days kept as they are
+            db.execute(
+                update(AnalyticsDaily)
+                .where(AnalyticsDaily.user_id.not_in(select(User.id)))
+                .values(user_id=None)
+            )
+        db.execute(insert(AnalyticsDaily).from_select(_ROLLUP_COLUMNS, source))
+        db.commit()
+        return True
     
     @staticmethod
     def get_total_queries(db: Session, user_id: Optional[int] = None) -> int:
@@ -54,10 +259,19 @@ class AnalyticsService:
     @staticmethod
     def get_popular_queries(db: Session, limit: int = 10, user_id: Optional[int] = None):
         """Get most common queries."""
-        query = db.query(
-            Analytics.query,
-            func.count(Analytics.id).label('count')
-        ).group_by(Analytics.query).order_by(func.count(Analytics.id).desc())
+        if db.get_bind().dialect.name == "postgresql" and not user_id:
+            # Group on a fixed-size key (read in order from ix_analytics_query_md5) instead
+            # of the full query text; one user's slice is small enough to group by text
+            query = db.query(
+                func.min(Analytics.query).label('query'),
+                func.count(Analytics.id).label('count')
+            ).group_by(func.md5(Analytics.query))
+        else:
+            query = db.query(
+                Analytics.query,
+                func.count(Analytics.id).label('count')
+            ).group_by(Analytics.query)
+        query = query.order_by(func.count(Analytics.id).desc())
         
         if user_id:
             query = query.filter(Analytics.user_id == user_id)
@@ -66,38 +280,51 @@ class AnalyticsService:
     
     @staticmethod
     def get_queries_by_timeframe(db: Session, days: int = 7, user_id: Optional[int] = None):
-        """Get queries grouped by date for a timeframe."""
+        """Get queries grouped by date for a timeframe.
+        
+        Whole days are read from the analytics_daily rollup (as fresh as its last
+        refresh); sub-day windows still scan the base table.
+        """
         start_date = datetime.utcnow() - timedelta(days=days)
         
+        if days < 1:
+            query = db.query(
+                func.date(Analytics.created_at).label('date'),
+                func.count(Analytics.id).label('count')
+            ).filter(Analytics.created_at >= start_date).group_by(
+                func.date(Analytics.created_at)
+            ).order_by(func.date(Analytics.created_at))
+            
+            if user_id:
+                query = query.filter(Analytics.user_id == user_id)
+            
+            return query.all()
+        
         query = db.query(
-            func.date(Analytics.created_at).label('date'),
-            func.count(Analytics.id).label('count')
-        ).filter(Analytics.created_at >= start_date).group_by(
-            func.date(Analytics.created_at)
-        ).order_by(func.date(Analytics.created_at))
+            AnalyticsDaily.day.label('date'),
+            func.sum(AnalyticsDaily.query_count).label('count')
+        ).filter(AnalyticsDaily.day >= start_date.date()).group_by(
+            AnalyticsDaily.day
+        ).order_by(AnalyticsDaily.day)
         
         if user_id:
-            query = query.filter(Analytics.user_id == user_id)
+            query = query.filter(AnalyticsDaily.user_id == user_id)
         
         return query.all()
     
     @staticmethod
     def get_rag_usage_stats(db: Session, user_id: Optional[int] = None):
         """Get statistics on RAG usage."""
-        query = db.query(Analytics).filter(Analytics.rag_sources_used > 0)
+        # Count and average in one pass; served by the partial index ix_analytics_rag
+        query = db.query(
+            func.count(Analytics.id),
+            func.avg(Analytics.rag_sources_used)
+        ).filter(Analytics.rag_sources_used > 0)
         
         if user_id:
             query = query.filter(Analytics.user_id == user_id)
         
-        total_with_rag = query.count()
-        avg_sources = db.query(func.avg(Analytics.rag_sources_used)).filter(
-            Analytics.rag_sources_used > 0
-        )
-        
-        if user_id:
-            avg_sources = avg_sources.filter(Analytics.user_id == user_id)
-        
-        avg = avg_sources.scalar()
+        total_with_rag, avg = query.one()
         
         return {
             'queries_with_rag': total_with_rag,
@@ -106,15 +333,49 @@ class AnalyticsService:
     
     @staticmethod
     def get_dashboard_stats(db: Session, user_id: Optional[int] = None):
-        """Get comprehensive dashboard statistics."""
+        """Get comprehensive dashboard statistics in a single round trip.
+        
+        queries_last_7_days comes from the analytics_daily rollup: whole UTC days from
+        seven days ago through today, as of the last refresh (up to
+        analytics_rollup_interval seconds behind the live total_queries).
+        """
+        params = {
+            "since": (datetime.utcnow() - timedelta(days=7)).date(),
+            "popular_limit": 5,
+        }
+        all_users, one_user = _DASHBOARD.get(db.get_bind().dialect.name, _DASHBOARD[None])
+        if user_id:
+            stmt = one_user
+            params["uid"] = user_id
+        else:
+            stmt = all_users
+        
+        total, avg_time, rag_count, rag_avg = 0, None, 0, None
+        popular, by_day = [], []
+        for section, label, n, val in db.execute(stmt, params):
+            if section == 'totals':
+                total, avg_time = n, val
+            elif section == 'rag':
+                rag_count, rag_avg = n, val
+            elif section == 'popular':
+                popular.append({'query': label, 'count': n})
+            else:
+                by_day.append({'date': label, 'count': n})
+        
+        # UNION ALL does not preserve the branches' ORDER BY
+        popular.sort(key=lambda row: row['count'], reverse=True)
+        by_day.sort(key=lambda row: row['date'])
+        
         return {
-            'total_queries': AnalyticsService.get_total_queries(db, user_id),
-            'average_response_time': AnalyticsService.get_average_response_time(db, user_id),
-            'popular_queries': AnalyticsService.get_popular_queries(db, 5, user_id),
-            'queries_last_7_days': AnalyticsService.get_queries_by_timeframe(db, 7, user_id),
-            'rag_stats': AnalyticsService.get_rag_usage_stats(db, user_id)
+            'total_queries': total,
+            'average_response_time': round(float(avg_time), 2) if avg_time else 0.0,
+            'popular_queries': popular,
+            'queries_last_7_days': by_day,
+            'rag_stats': {
+                'queries_with_rag': rag_count,
+                'average_sources': round(float(rag_avg), 2) if rag_avg else 0.0
+            }
         }
 
-
 # Global analytics service instance
 analytics_service = AnalyticsService()
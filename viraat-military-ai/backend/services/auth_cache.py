@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from cachetools import TTLCache
+from database.models import User
+from config import settings
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Immutable snapshot of the authenticated user, safe to share across requests."""
+    id: int
+    username: str
+    role: str
+    role_level: int
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "CurrentUser":
+        return cls(user.id, user.username, user.role, user.role_level, user.is_active)
+
+
+class AuthCache:
+    """Short-lived cache of verified tokens and their users for get_current_user."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 5):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        """Hash the token so raw credentials are never held as cache keys."""
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Tuple[dict, CurrentUser]]:
+        """Return the cached (payload, user) for a token that has not yet expired."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None:
+            return None
+        payload, user = entry
+        # The cache TTL is global; never serve an entry past the token's own expiry
+        if payload["exp"] <= time.time():
+            self.invalidate(token)
+            return None
+        return payload, user
+
+    def put(self, token: str, payload: dict, user: CurrentUser) -> None:
+        """Cache a verified token. Only call with payloads that passed verification."""
+        if payload.get("exp", 0) <= time.time():
+            return
+        with self._lock:
+            self._cache[self._key(token)] = (payload, user)
+
+    def invalidate(self, token: str) -> None:
+        """Drop a single token."""
+        with self._lock:
+            self._cache.pop(self._key(token), None)
+
+    def clear(self) -> None:
+        """Drop every entry (e.g. after a user is updated or deleted)."""
+        with self._lock:
+            self._cache.clear()
+
+
+# Global auth cache instance
+auth_cache = AuthCache(maxsize=settings.auth_cache_maxsize, ttl=settings.auth_cache_ttl)
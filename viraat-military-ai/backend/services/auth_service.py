@@ -1,16 +1,55 @@
+import hashlib
+import hmac
+import threading
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
+from typing import Optional, Union
+from cachetools import TTLCache
+import jwt
+from jwt import PyJWTError
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from database.models import User
+from sqlalchemy import select, bindparam
+from sqlalchemy.orm import Session, load_only, raiseload
+from database.models import User, ROLE_LEVELS
+from services.auth_cache import auth_cache, CurrentUser
 from config import settings
 from loguru import logger
 
 
-# Password hashing
-# Password hashing
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+try:
+    import argon2  # noqa: F401 - passlib's argon2 backend
+    ARGON2_AVAILABLE = True
+except ImportError:
+    ARGON2_AVAILABLE = False
+
+
+# Password hashing: new hashes use argon2id when available; existing pbkdf2_sha256
+# hashes still verify and are re-hashed on the user's next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "pbkdf2_sha256"] if ARGON2_AVAILABLE else ["pbkdf2_sha256"],
+    deprecated="auto",
+    # OWASP argon2id baseline (19 MiB, 2 passes); passlib's default is ~100 MiB per verify
+    argon2__memory_cost=19456,
+    argon2__time_cost=2,
+    argon2__parallelism=1
+)
+
+# Successful verifications, keyed by HMAC digests of (hash, password) so no plaintext is held
+_verify_cache = TTLCache(maxsize=settings.password_cache_maxsize, ttl=settings.password_cache_ttl)
+_verify_lock = threading.Lock()
+
+
+def _verify_key(plain_password: str, hashed_password: str) -> bytes:
+    secret = settings.secret_key.encode()
+    return (hmac.new(secret, hashed_password.encode(), hashlib.sha256).digest()
+            + hmac.new(secret, plain_password.encode(), hashlib.sha256).digest())
+
+# Per-request lookups, built once so SQLAlchemy's compiled cache hits on every call
+_USER_BY_NAME = select(User).where(User.username == bindparam("u"))
+_REQUEST_USER_BY_NAME = select(User).options(
+    load_only(User.id, User.username, User.full_name, User.role, User.role_level, User.is_active),
+    raiseload('*')
+).where(User.username == bindparam("u"))
+_USER_BY_EMAIL = select(User).where(User.email == bindparam("e"))
 
 
 class AuthService:
@@ -18,8 +57,18 @@ class AuthService:
     
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
-        """Verify a password against a hash."""
-        return pwd_context.verify(plain_password, hashed_password)
+        """Verify a password against a hash, skipping the KDF for recently verified pairs."""
+        key = _verify_key(plain_password, hashed_password)
+        with _verify_lock:
+            if key in _verify_cache:
+                return True
+        
+        if not pwd_context.verify(plain_password, hashed_password):
+            return False
+        
+        with _verify_lock:
+            _verify_cache[key] = True
+        return True
     
     @staticmethod
     def get_password_hash(password: str) -> str:
@@ -43,23 +92,27 @@ class AuthService:
     
     @staticmethod
     def decode_access_token(token: str) -> Optional[dict]:
-        """Decode and verify a JWT token."""
+        """Decode and verify a JWT token (get_current_user caches the result per token)."""
         try:
-            payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-            return payload
-        except JWTError as e:
+            return jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+        except PyJWTError as e:
             logger.error(f"JWT decode error: {str(e)}")
             return None
     
     @staticmethod
     def get_user(db: Session, username: str) -> Optional[User]:
         """Get user by username."""
-        return db.query(User).filter(User.username == username).first()
+        return db.execute(_USER_BY_NAME, {"u": username}).scalar_one_or_none()
+    
+    @staticmethod
+    def get_request_user(db: Session, username: str) -> Optional[User]:
+        """Get the columns an authenticated request needs; relationships raise instead of lazy-loading."""
+        return db.execute(_REQUEST_USER_BY_NAME, {"u": username}).scalar_one_or_none()
     
     @staticmethod
     def get_user_by_email(db: Session, email: str) -> Optional[User]:
         """Get user by email."""
-        return db.query(User).filter(User.email == email).first()
+        return db.execute(_USER_BY_EMAIL, {"e": email}).scalar_one_or_none()
     
     @staticmethod
     def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
@@ -69,6 +122,13 @@ class AuthService:
             return None
         if not AuthService.verify_password(password, user.hashed_password):
             return None
+        if pwd_context.needs_update(user.hashed_password):
+            # Upgrade legacy hashes (e.g. pbkdf2_sha256 -> argon2) while the password is at hand
+            new_hash = AuthService.get_password_hash(password)
+            user.hashed_password = new_hash
+            db.commit()
+            with _verify_lock:
+                _verify_cache[_verify_key(password, new_hash)] = True
         return user
     
     @staticmethod
@@ -82,12 +142,12 @@ class AuthService:
             email=email,
             hashed_password=hashed_password,
             full_name=full_name,
-            role=role
+            role=role,
+            role_level=ROLE_LEVELS.get(role, 0)
         )
         
         db.add(user)
         db.commit()
-        db.refresh(user)
         
         logger.info(f"Created new user: {username}")
         return user
@@ -105,9 +165,11 @@ class AuthService:
                     setattr(user, "hashed_password", AuthService.get_password_hash(value))
                 else:
                     setattr(user, key, value)
+                if key == "role":
+                    user.role_level = ROLE_LEVELS.get(value, 0)
         
         db.commit()
-        db.refresh(user)
+        auth_cache.clear()
         return user
     
     @staticmethod
@@ -119,17 +181,13 @@ class AuthService:
         
         db.delete(user)
         db.commit()
+        auth_cache.clear()
         return True
     
     @staticmethod
-    def check_role_permission(user: User, required_role: str) -> bool:
+    def check_role_permission(user: Union[User, CurrentUser], required_role: str) -> bool:
         """Check if user has required role permission."""
-        role_hierarchy = {"admin": 3, "analyst": 2, "user": 1}
-        
-        user_level = role_hierarchy.get(user.role, 0)
-        required_level = role_hierarchy.get(required_role, 0)
-        
-        return user_level >= required_level
+        return user.role_level >= ROLE_LEVELS.get(required_role, 0)
 
 
 # Global auth service instance
@@ -1,10 +1,22 @@
-from typing import List, Optional, Dict
-from sqlalchemy.orm import Session
+from typing import List, Optional, Dict, Sequence, Tuple
+from sqlalchemy import insert, update, delete, select, bindparam, and_, or_
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy.sql import func
 from database.models import Conversation, Message
 from datetime import datetime
 from loguru import logger
 
 
+# Built once so SQLAlchemy's compiled cache hits on every request
+_CONV_BY_ID = select(Conversation).where(
+    Conversation.id == bindparam("c"),
+    Conversation.user_id == bindparam("u")
+)
+# LLM context only needs role and content: plain rows, no ORM entities or JSON metadata
+_HISTORY = select(Message.role, Message.content).where(
+    Message.conversation_id == bindparam("c")
+).order_by(Message.created_at.asc(), Message.id.asc()).limit(bindparam("n"))
+
 class ConversationService:
     """Service for managing conversations and messages."""
     
@@ -18,7 +30,6 @@ class ConversationService:
         
         db.add(conversation)
         db.commit()
-        db.refresh(conversation)
         
         logger.info(f"Created conversation {conversation.id} for user {user_id}")
         return conversation
@@ -26,17 +37,39 @@ class ConversationService:
     @staticmethod
     def get_conversation(db: Session, conversation_id: int, user_id: int) -> Optional[Conversation]:
         """Get a conversation by ID."""
-        return db.query(Conversation).filter(
-            Conversation.id == conversation_id,
-            Conversation.user_id == user_id
-        ).first()
+        return db.execute(_CONV_BY_ID, {"c": conversation_id, "u": user_id}).scalar_one_or_none()
     
     @staticmethod
-    def get_user_conversations(db: Session, user_id: int, limit: int = 50) -> List[Conversation]:
-        """Get all conversations for a user."""
-        return db.query(Conversation).filter(
-            Conversation.user_id == user_id
-        ).order_by(Conversation.updated_at.desc()).limit(limit).all()
+    def get_user_conversations(db: Session, user_id: int, limit: int = 50,
+                               before: Optional[datetime] = None,
+                               before_id: Optional[int] = None) -> List[Conversation]:
+        """Get a user's conversations, most recently updated first.
+        
+        Pass the last conversation's updated_at and id as `before` and `before_id` to
+        fetch the next page. The id breaks ties between conversations updated in the
+        same second, so none are skipped at a page boundary.
+        """
+        query = db.query(Conversation).options(
+            load_only(Conversation.id, Conversation.title,
+                      Conversation.created_at, Conversation.updated_at)
+        ).filter(Conversation.user_id == user_id)
+        
+        if before is not None:
+            # SQLite keeps CURRENT_TIMESTAMP as 'YYYY-MM-DD HH:MM:SS' text; render the
+            # cursor the same way so the comparison is not thrown off by '.000000'
+            if db.get_bind().dialect.name == "sqlite":
+                before = func.datetime(before)
+            if before_id is None:
+                query = query.filter(Conversation.updated_at < before)
+            else:
+                query = query.filter(or_(
+                    Conversation.updated_at < before,
+                    and_(Conversation.updated_at == before, Conversation.id < before_id)
+                ))
+        
+        return query.order_by(
+            Conversation.updated_at.desc(), Conversation.id.desc()
+        ).limit(limit).all()
     
     @staticmethod
     def update_conversation_title(db: Session, conversation_id: int, user_id: int, 
@@ -48,19 +81,21 @@ class ConversationService:
         
         conversation.title = title
         db.commit()
-        db.refresh(conversation)
         
         return conversation
     
     @staticmethod
     def delete_conversation(db: Session, conversation_id: int, user_id: int) -> bool:
         """Delete a conversation."""
-        conversation = ConversationService.get_conversation(db, conversation_id, user_id)
-        if not conversation:
-            return False
-        
-        db.delete(conversation)
+        # One DELETE; the database cascades to messages (ON DELETE CASCADE)
+        result = db.execute(
+            delete(Conversation)
+            .where(Conversation.id == conversation_id, Conversation.user_id == user_id)
+            .execution_options(synchronize_session=False)
+        )
         db.commit()
+        if not result.rowcount:
+            return False
         
         logger.info(f"Deleted conversation {conversation_id}")
         return True
@@ -77,24 +112,41 @@ class ConversationService:
         )
         
         db.add(message)
+        # Bump the conversation's updated_at in the same transaction: no SELECT, one commit
+        db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(updated_at=func.now())
+        )
         db.commit()
-        db.refresh(message)
-        
-        # Update conversation's updated_at
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if conversation:
-            conversation.updated_at = datetime.utcnow()
-            db.commit()
         
         return message
     
+    @staticmethod
+    def add_messages_bulk(db: Session, conversation_id: int,
+                          messages: Sequence[Tuple[str, str]]) -> int:
+        """Add several (role, content) messages in one INSERT and one commit."""
+        if not messages:
+            return 0
+        
+        db.execute(insert(Message), [
+            {"conversation_id": conversation_id, "role": role, "content": content}
+            for role, content in messages
+        ])
+        db.query(Conversation).filter(Conversation.id == conversation_id).update(
+            {Conversation.updated_at: func.now()}, synchronize_session=False
+        )
+        db.commit()
+        
+        return len(messages)
+    
     @staticmethod
     def get_conversation_messages(db: Session, conversation_id: int, 
                                  limit: Optional[int] = None) -> List[Message]:
         """Get all messages in a conversation."""
         query = db.query(Message).filter(
             Message.conversation_id == conversation_id
-        ).order_by(Message.created_at.asc())
+        ).order_by(Message.created_at.asc(), Message.id.asc())  # bulk inserts share a timestamp
         
         if limit:
             query = query.limit(limit)
@@ -105,18 +157,8 @@ class ConversationService:
     def get_conversation_history(db: Session, conversation_id: int, 
                                 max_messages: int = 10) -> List[Dict]:
         """Get conversation history formatted for LLM context."""
-        messages = ConversationService.get_conversation_messages(
-            db, conversation_id, limit=max_messages
-        )
-        
-        history = []
-        for msg in messages:
-            history.append({
-                'role': msg.role,
-                'content': msg.content
-            })
-        
-        return history
+        rows = db.execute(_HISTORY, {"c": conversation_id, "n": max_messages})
+        return [{'role': role, 'content': content} for role, content in rows]
     
     @staticmethod
     def clear_conversation_messages(db: Session, conversation_id: int, user_id: int) -> bool:
@@ -125,7 +167,11 @@ class ConversationService:
         if not conversation:
             return False
         
-        db.query(Message).filter(Message.conversation_id == conversation_id).delete()
+        db.execute(
+            delete(Message)
+            .where(Message.conversation_id == conversation_id)
+            .execution_options(synchronize_session=False)
+        )
         db.commit()
         
         logger.info(f"Cleared messages in conversation {conversation_id}")
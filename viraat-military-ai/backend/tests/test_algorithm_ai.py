@@ -30,8 +30,8 @@ async def test_ai_flow():
     # 3. Test Response Generation
     print("\n--- 3. Testing Response Generation ---")
     await llm_handler.initialize()
-    context = rag_engine.get_context_for_query(query)
-    response = await llm_handler.generate_response(query, context)
+    rag = rag_engine.search_and_format(query)
+    response = await llm_handler.generate_response(query, rag.context, refs=rag.refs)
     print("Response Generated:")
     print("-" * 30)
     print(response)
@@ -40,7 +40,7 @@ async def test_ai_flow():
     # 4. Test Streaming
     print("\n--- 4. Testing Streaming ---")
     print("Stream: ", end="", flush=True)
-    async for chunk in llm_handler.generate_stream(query, context):
+    async for chunk in llm_handler.generate_stream(query, rag.context, refs=rag.refs):
         print(chunk, end="", flush=True)
     print("\n")
     
@@ -0,0 +1,42 @@
+import sys
+import os
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import func
+
+from database.models import Base, Conversation, User
+from services.conversation_service import conversation_service
+
+
+def _session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'conversations.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, expire_on_commit=False)()
+
+
+def test_keyset_pages_keep_conversations_with_the_same_updated_at(tmp_path):
+    db = _session(tmp_path)
+    db.add(User(username="pager", email="pager@viraat.ai", hashed_password="x"))
+    db.commit()
+    for i in range(5):
+        conversation_service.create_conversation(db, 1, f"Conversation {i}")
+    # One statement, one CURRENT_TIMESTAMP: every row lands in the same second
+    db.execute(update(Conversation).values(updated_at=func.now()))
+    db.commit()
+    db.expire_all()
+
+    seen = []
+    page = conversation_service.get_user_conversations(db, 1, limit=2)
+    while page:
+        seen.extend(conversation.id for conversation in page)
+        last = page[-1]
+        page = conversation_service.get_user_conversations(
+            db, 1, limit=2, before=last.updated_at, before_id=last.id
+        )
+
+    assert len({conversation.updated_at for conversation in db.query(Conversation)}) == 1
+    assert seen == [5, 4, 3, 2, 1]
@@ -0,0 +1,58 @@
+import asyncio
+import shutil
+import sys
+import os
+
+# Add backend and knowledge-base to path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "knowledge-base"))
+
+import ingest
+from models.rag_engine import RAGEngine
+
+SECTION = "Field radios are checked before every patrol and logged by the signals officer on duty. " * 2
+
+
+def _ingest_in_new_process(sources, monkeypatch):
+    """Run ingestion with a fresh engine, as a separate CLI run would; returns chunks added.
+
+    The engine persists its index under sources/.cache instead of the repo's knowledge base.
+    """
+    engine = RAGEngine()
+
+    async def initialize():
+        engine._index_cache = (str(sources / ".cache"), "test")
+        engine._load_index(*engine._index_cache)
+        return True
+
+    added = []
+    add_documents_batch = engine.add_documents_batch
+
+    def counting_add(documents, metadatas=None, ids=None):
+        added.append(len(documents))
+        return add_documents_batch(documents, metadatas, ids)
+
+    engine.initialize = initialize
+    engine.add_documents_batch = counting_add
+    monkeypatch.setattr(ingest, "rag_engine", engine)
+    assert asyncio.run(ingest.ingest_documents(str(sources)))
+    return sum(added)
+
+
+def test_second_ingest_of_unchanged_sources_adds_nothing(tmp_path, monkeypatch):
+    for i in range(3):
+        (tmp_path / f"manual_{i}.md").write_text(
+            f"# Manual {i}\n\n{SECTION}\n\n## Section A\n\n{SECTION}{i}\n", encoding="utf-8"
+        )
+    (tmp_path / "notes.txt").write_text(f"{SECTION}\n\n{SECTION}notes\n", encoding="utf-8")
+
+    first_run = _ingest_in_new_process(tmp_path, monkeypatch)
+    assert first_run > 0
+    assert (tmp_path / ".cache" / "test.joblib").exists()
+    assert len(ingest.load_ingested_ids(tmp_path)) == first_run
+
+    assert _ingest_in_new_process(tmp_path, monkeypatch) == 0
+
+    # Without the persisted index the manifest alone does not skip anything
+    shutil.rmtree(tmp_path / ".cache")
+    assert _ingest_in_new_process(tmp_path, monkeypatch) == first_run
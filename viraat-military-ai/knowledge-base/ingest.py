@@ -4,10 +4,17 @@ Knowledge Base Ingestion Script
 Processes documents and adds them to the ChromaDB vector store.
 """
 
+import mmap
 import os
+import re
+import shutil
 import sys
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import AsyncIterator, Dict, Iterator, List, Set, Tuple, Union
 import asyncio
 
 # Add parent directory to path
@@ -16,71 +23,185 @@ sys.path.append(str(Path(__file__).parent.parent / "backend"))
 from models.rag_engine import rag_engine
 from loguru import logger
 
+try:
+    from blake3 import blake3 as _content_hash
+except ImportError:
+    from hashlib import blake2b as _content_hash
 
-def load_markdown_file(file_path: str) -> List[Dict[str, str]]:
+
+# Chunks handed to the RAG engine per call, and parsed files allowed to wait for it
+INGEST_BATCH_SIZE = 64
+INGEST_QUEUE_FILES = 4
+
+# Ids of every chunk ingested so far, one per line, kept in the sources directory
+# beside the engine's .cache index (which prunes files it does not own)
+INGESTED_IDS_FILE = ".ingested_ids"
+
+@dataclass(slots=True)
+class Chunk:
+    """A piece of a source file to index."""
+    content: str
+    heading: str
+    source: str
+
+
+# Files are scanned as bytes through a read-only memory map; only the slices that
+# become chunks are decoded, so the whole file is never held as one decoded str.
+
+# A "# ", "## " or "### " heading line (deeper headings are body text)
+_HEADER_RE = re.compile(rb'^(#{1,3} [^\n]*)$', re.M)
+
+# A paragraph break: a blank line (LF or CRLF)
+_PARAGRAPH_BREAK_RE = re.compile(rb'\r?\n\r?\n')
+
+
+@contextmanager
+def _mapped(file_path: str) -> Iterator[Union[mmap.mmap, bytes]]:
+    """Map a file read-only (empty files cannot be mapped and yield b'')."""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _decode(data: bytes) -> str:
+    """Decode a slice the way text-mode open() would (UTF-8, universal newlines)."""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def iter_paragraphs(data: Union[mmap.mmap, bytes]) -> Iterator[str]:
+    """Yield the paragraphs of data.split('\n\n') lazily, decoding one at a time."""
+    start = 0
+    for match in _PARAGRAPH_BREAK_RE.finditer(data):
+        yield _decode(data[start:match.start()])
+        start = match.end()
+    yield _decode(data[start:])
+
+
+def load_markdown_file(file_path: str) -> List[Chunk]:
     """Load and chunk a markdown file."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Split by headers to create chunks
+    source = os.path.basename(file_path)
     chunks = []
-    current_chunk = ""
     current_heading = ""
     
-    for line in content.split('\n'):
-        if line.startswith('# '):
-            # Main heading - start new document
-            if current_chunk:
-                chunks.append({
-                    'content': current_chunk.strip(),
-                    'heading': current_heading,
-                    'source': os.path.basename(file_path)
-                })
-            current_heading = line.replace('# ', '').strip()
-            current_chunk = line + '\n'
-        elif line.startswith('## ') or line.startswith('### '):
-            # Sub-heading - create chunk
-            if current_chunk and len(current_chunk) > 100:  # Minimum chunk size
-                chunks.append({
-                    'content': current_chunk.strip(),
-                    'heading': current_heading,
-                    'source': os.path.basename(file_path)
-                })
-            current_chunk = line + '\n'
-        else:
-            current_chunk += line + '\n'
-    
-    # Add final chunk
-    if current_chunk:
-        chunks.append({
-            'content': current_chunk.strip(),
-            'heading': current_heading,
-            'source': os.path.basename(file_path)
-        })
+    with _mapped(file_path) as data:
+        # Split by headers to create chunks: each runs from its heading line to the next one
+        headings = [(match.start(), match.group(1)) for match in _HEADER_RE.finditer(data)]
+        ends = [start for start, _ in headings[1:]] + [len(data)]
+        current_chunk = _decode(data[:headings[0][0]] if headings else data[:])
+        
+        for (start, heading_line), end in zip(headings, ends):
+            if heading_line.startswith(b'# '):
+                # Main heading - start new document
+                if current_chunk:
+                    chunks.append(Chunk(current_chunk.strip(), current_heading, source))
+                current_heading = _decode(heading_line).replace('# ', '').strip()
+            elif current_chunk and len(current_chunk) > 100:  # Minimum chunk size
+                # Sub-heading - create chunk
+                chunks.append(Chunk(current_chunk.strip(), current_heading, source))
+            current_chunk = _decode(data[start:end])
+    
+    # Add final chunk (always emitted, even when empty, as the line-by-line loader did)
+    chunks.append(Chunk(current_chunk.strip(), current_heading, source))
     
     return chunks
 
 
-def load_text_file(file_path: str) -> List[Dict[str, str]]:
+def load_text_file(file_path: str) -> List[Chunk]:
     """Load a plain text file."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
     # Simple chunking by paragraphs
-    paragraphs = content.split('\n\n')
     chunks = []
     
-    for para in paragraphs:
-        if para.strip() and len(para.strip()) > 50:
-            chunks.append({
-                'content': para.strip(),
-                'heading': '',
-                'source': os.path.basename(file_path)
-            })
+    with _mapped(file_path) as data:
+        for para in iter_paragraphs(data):
+            if para.strip() and len(para.strip()) > 50:
+                chunks.append(Chunk(para.strip(), '', os.path.basename(file_path)))
     
     return chunks
 
 
+_LOADERS = {".md": load_markdown_file, ".txt": load_text_file}
+
+
+def _parse_file(file_path: str) -> List[Chunk]:
+    """Chunk one source file (runs in a worker process)."""
+    return _LOADERS[os.path.splitext(file_path)[1]](file_path)
+
+
+def _chunk_id(content: str) -> str:
+    """Content-addressed id: identical chunks share it wherever and whenever they are parsed."""
+    return _content_hash(content.encode('utf-8')).hexdigest()[:32]
+
+
+def load_ingested_ids(sources_path: Path) -> Set[str]:
+    """Ids of the chunks earlier runs ingested from sources_path (empty if none)."""
+    try:
+        with open(sources_path / INGESTED_IDS_FILE, 'r', encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def save_ingested_ids(sources_path: Path, ids: Set[str]):
+    """Replace the ingested-id manifest for sources_path atomically."""
+    manifest = sources_path / INGESTED_IDS_FILE
+    with open(f"{manifest}.tmp", 'w', encoding='utf-8') as f:
+        f.writelines(f"{doc_id}\n" for doc_id in sorted(ids))
+    os.replace(f"{manifest}.tmp", manifest)
+
+
+async def iter_source_files(sources_path: Path) -> AsyncIterator[Tuple[List[str], List[Dict], List[str]]]:
+    """Parse source files in a process pool, yielding (documents, metadatas, ids) per file in order."""
+    file_paths = []
+    for file_path in sources_path.glob("*"):
+        if not file_path.is_file() or file_path.name.startswith('.'):
+            continue
+        if file_path.suffix not in _LOADERS:
+            logger.warning(f"Unsupported file type: {file_path.suffix}")
+            continue
+        file_paths.append(file_path)
+    
+    loop = asyncio.get_running_loop()
+    workers = os.cpu_count() or 1
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded window of files in flight; results are consumed in submission order
+        pending = deque()
+        remaining = iter(file_paths)
+        for file_path in remaining:
+            pending.append((file_path, loop.run_in_executor(pool, _parse_file, str(file_path))))
+            if len(pending) >= 2 * workers:
+                break
+        
+        while pending:
+            file_path, future = pending.popleft()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, loop.run_in_executor(pool, _parse_file, str(next_path))))
+            
+            logger.info(f"Processing: {file_path.name}")
+            try:
+                chunks = await future
+            except Exception as e:
+                logger.error(f"Error processing {file_path.name}: {str(e)}")
+                continue
+            
+            documents, metadatas, ids = [], [], []
+            for chunk in chunks:
+                documents.append(chunk.content)
+                metadatas.append({
+                    'source': chunk.source,
+                    'heading': chunk.heading,
+                    'file_type': file_path.suffix
+                })
+                ids.append(_chunk_id(chunk.content))
+            
+            logger.info(f"  → Extracted {len(chunks)} chunks")
+            yield documents, metadatas, ids
+
+
 async def ingest_documents(sources_dir: str = "sources"):
     """Ingest all documents from sources directory."""
     logger.info("Starting knowledge base ingestion...")
@@ -99,73 +220,85 @@ async def ingest_documents(sources_dir: str = "sources"):
         logger.error(f"Sources directory not found: {sources_path}")
         return False
     
-    # Process all files
-    all_documents = []
-    all_metadatas = []
-    all_ids = []
-    doc_count = 0
+    # Bounded queue: parsing runs at most INGEST_QUEUE_FILES files ahead of the batcher
+    queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_FILES)
     
-    for file_path in sources_path.glob("*"):
-        if file_path.is_file():
-            logger.info(f"Processing: {file_path.name}")
-            
-            try:
-                if file_path.suffix == ".md":
-                    chunks = load_markdown_file(str(file_path))
-                elif file_path.suffix == ".txt":
-                    chunks = load_text_file(str(file_path))
-                else:
-                    logger.warning(f"Unsupported file type: {file_path.suffix}")
-                    continue
-                
-                # Add chunks to lists
-                for chunk in chunks:
-                    all_documents.append(chunk['content'])
-                    all_metadatas.append({
-                        'source': chunk['source'],
-                        'heading': chunk['heading'],
-                        'file_type': file_path.suffix
-                    })
-                    all_ids.append(f"{file_path.stem}_{doc_count}")
-                    doc_count += 1
-                
-                logger.info(f"  → Extracted {len(chunks)} chunks")
-                
-            except Exception as e:
-                logger.error(f"Error processing {file_path.name}: {str(e)}")
+    async def produce():
+        try:
+            async for batch in iter_source_files(sources_path):
+                await queue.put(batch)
+        finally:
+            await queue.put(None)
     
-    # Add all documents to RAG engine
-    if all_documents:
-        logger.info(f"\nAdding {len(all_documents)} document chunks to knowledge base...")
-        success = rag_engine.add_documents_batch(
-            documents=all_documents,
-            metadatas=all_metadatas,
-            ids=all_ids
+    producer = asyncio.create_task(produce())
+    
+    # Chunks ingested by an earlier run (or seen earlier in this run) are skipped, which
+    # makes re-running ingestion over unchanged sources a no-op. An id only counts while
+    # the loaded index still holds it: when the sources change, initialize() refits the
+    # index from scratch and those chunks have to be ingested again.
+    indexed_ids = {metadata['id'] for metadata in rag_engine.metadatas if 'id' in metadata}
+    known_ids = load_ingested_ids(sources_path) & indexed_ids
+    documents, metadatas, ids = [], [], []
+    added = skipped = 0
+    
+    def flush(size: int):
+        nonlocal documents, metadatas, ids, added
+        rag_engine.add_documents_batch(
+            documents=documents[:size],
+            metadatas=metadatas[:size],
+            ids=ids[:size]
         )
-        
-        if success:
-            logger.info("✓ Knowledge base ingestion complete!")
-            logger.info(f"Total documents in collection: {rag_engine.collection.count()}")
+        added += len(documents[:size])
+        documents, metadatas, ids = documents[size:], metadatas[size:], ids[size:]
+    
+    while (item := await queue.get()) is not None:
+        for document, metadata, doc_id in zip(*item):
+            if doc_id in known_ids:
+                skipped += 1
+                continue
+            known_ids.add(doc_id)
+            documents.append(document)
+            metadatas.append(metadata)
+            ids.append(doc_id)
+        while len(documents) >= INGEST_BATCH_SIZE:
+            flush(INGEST_BATCH_SIZE)
+    if documents:
+        flush(len(documents))
+    await producer
+    
+    if skipped:
+        logger.info(f"Skipped {skipped} chunks already in the knowledge base")
+    if not added:
+        if skipped:
+            logger.info("✓ Knowledge base already up to date")
             return True
-        else:
-            logger.error("Failed to add documents to knowledge base")
-            return False
-    else:
         logger.warning("No documents found to ingest")
         return False
+    
+    # Fit once over the whole corpus: TF-IDF weights depend on every document. The
+    # manifest is only written once build_index() has persisted the index it describes.
+    logger.info(f"\nIndexing {added} document chunks into the knowledge base...")
+    if rag_engine.build_index():
+        save_ingested_ids(sources_path, known_ids)
+        logger.info("✓ Knowledge base ingestion complete!")
+        logger.info(f"Total documents in collection: {rag_engine.get_stats()['document_count']}")
+        return True
+    
+    logger.error("Failed to build or save the knowledge base index")
+    return False
 
 
 async def test_search(query: str):
     """Test search functionality."""
     logger.info(f"\nTesting search with query: '{query}'")
     
-    results = await rag_engine.search(query, top_k=3)
+    results = rag_engine.search(query, top_k=3)
     
     logger.info(f"Found {len(results)} results:")
     for i, result in enumerate(results, 1):
         logger.info(f"\n--- Result {i} (Similarity: {result['similarity']:.3f}) ---")
         logger.info(f"Source: {result['metadata'].get('source', 'Unknown')}")
-        logger.info(f"Content preview: {result['document'][:200]}...")
+        logger.info(f"Content preview: {result['content'][:200]}...")
 
 
 async def main():
@@ -180,8 +313,11 @@ async def main():
     
     if args.reset:
         logger.warning("Resetting knowledge base...")
-        await rag_engine.initialize()
-        rag_engine.reset_collection()
+        # Drop the RAG engine's persisted index and forget what earlier runs ingested, so
+        # the index is refitted from the sources and every chunk is ingested again
+        sources_path = Path(__file__).parent / "sources"
+        shutil.rmtree(sources_path / ".cache", ignore_errors=True)
+        (sources_path / INGESTED_IDS_FILE).unlink(missing_ok=True)
     
     # Ingest documents
     await ingest_documents()